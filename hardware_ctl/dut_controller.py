@@ -74,7 +74,7 @@ class DutController:
         cmd_base = parts[0]
         cmd_args = parts[1:]
 
-        logging.debug(f"Sending command to DUT: {cmd_base} {' '.join(cmd_args)}")
+        logging.debug("Sending command to DUT: %s %s", cmd_base, ' '.join(cmd_args))
         try:
             response = self.cli.send_command(cmd_base, *cmd_args)
             if not response.OK:
@@ -198,6 +198,22 @@ class DutController:
         resp = self._send_command('get_buck_status')
         return self._parse_response_string(resp, 'get_buck_status')
 
+    def get_status(self) -> tuple:
+        """
+        Vrátí (mode, current, voltage) pro smyčky kroků testu. Firmware nemá společný příkaz,
+        takže jde o tři příkazy za sebou - volající ale čtení odbaví jedním voláním (jeden přesun do vlákna).
+        """
+        return self.get_operation_mode(), self.get_battery_current(), self.get_battery_voltage()
+
+    def get_snapshot(self) -> tuple:
+        """
+        Vrátí všechna měření v pořadí sloupců DataLoggeru:
+        (dut_time, vbat, ibat, ntc_temp, vsys, die_temp, iba_meas_status, buck_status, mode).
+        """
+        return (self.get_dut_timestamp(), self.get_battery_voltage(), self.get_battery_current(),
+                self.get_ntc_temp(), self.get_vsys(), self.get_die_temp(),
+                self.get_iba_meas_status(), self.get_buck_status(), self.get_operation_mode())
+
     # --- Volitelné metody ---
     def set_discharge_current(self, current_ma: int) -> bool:
         if 'set_discharge_current' not in self.cmds:
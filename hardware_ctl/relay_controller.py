@@ -1,6 +1,7 @@
 # hardware_ctl/relay_controller.py
 
 import logging
+import threading
 import time
 from pathlib import Path
 import sys
@@ -8,11 +9,11 @@ from typing import List, Optional, Set # Přidáno List, Optional, Set
 
 # --- Dynamické přidání cest k driverům ---
 libs_path = Path(__file__).parent.parent / "libs"
-if str(libs_path) not in sys.path:
-    sys.path.insert(0, str(libs_path))
 backend_path = libs_path / "backend"
-if str(backend_path) not in sys.path:
-     sys.path.insert(0, str(backend_path))
+_existing_paths = set(sys.path) # Jedna kontrola místo lineárního hledání v sys.path pro každou cestu
+for _p in (str(libs_path), str(backend_path)):
+    if _p not in _existing_paths:
+        sys.path.insert(0, _p)
 # -----------------------------------------
 
 # --- Importy z Deditec driveru (s fallbackem) ---
@@ -66,6 +67,50 @@ class RelayController:
         if not self.usb_power_pins:
              logging.warning("No valid USB power relay pins configured. USB control will not work.")
 
+        # Jedno TCP spojení s deskou drží controller po celou dobu běhu (otevře se líně při prvním příkazu)
+        self._deditec: Optional[Deditec_1_16_on] = None
+        # Relé ovládá i vlákno bzučáku (a souběžné módy v simulaci) - zámek kryje spojení i čtení/zápis pin cache
+        self._session_lock = threading.RLock()
+
+    def _get_session(self) -> Optional['Deditec_1_16_on']:
+        """Vrátí připojenou Deditec session, případně ji (znovu) naváže. Volat se zámkem _session_lock."""
+        if self._deditec is None or self._deditec.socket is None:
+            deditec = Deditec_1_16_on(ip=self.ip_address, port=self.port, timeout_seconds=3) # Timeout pro spojení
+            if not deditec.connect():
+                return None
+            logging.debug("Opened persistent Deditec session to %s:%s", self.ip_address, self.port)
+            self._deditec = deditec
+        return self._deditec
+
+    def _close_session(self):
+        """Zavře perzistentní spojení s deskou (bezpečné volat opakovaně). Volat se zámkem _session_lock."""
+        if self._deditec is not None:
+            self._deditec.close_connection()
+            self._deditec = None
+
+    def _send_on_session(self, command_bytes: bytes) -> int:
+        """Odešle příkaz přes perzistentní spojení; při chybě se jednou znovu připojí (deska mohla spojení zavřít)."""
+        with self._session_lock:
+            for attempt in range(2):
+                session = self._get_session()
+                if session is None:
+                    raise ConnectionError(f"Failed to connect to Deditec device at {self.ip_address}:{self.port}")
+                response = session.send_command(command_bytes)
+                if response == 0:
+                    return response
+                self._close_session()
+                if attempt == 0: logging.warning(f"Deditec command failed (code {response}), reconnecting and retrying...")
+            return response
+
+    def ping(self) -> bool:
+        """Ověří spojení s deskou (naváže perzistentní session, pokud ještě neexistuje)."""
+        start = time.perf_counter()
+        with self._session_lock:
+            ok = self._get_session() is not None
+        if ok: logging.info(f"Deditec session to {self.ip_address}:{self.port} is up ({(time.perf_counter() - start) * 1000:.1f} ms).")
+        else: logging.error(f"Failed to connect to Deditec at {self.ip_address}:{self.port}.")
+        return ok
+
     def _validate_pin_list(self, name: str, pins: List[int]) -> List[int]:
         """Validuje seznam pinů a vrátí pouze platné unikátní piny."""
         valid_pins = set()
@@ -81,42 +126,50 @@ class RelayController:
 
     def _execute_relay_command(self, pins_to_turn_on: List[int], pins_to_turn_off: List[int]) -> bool:
         """Interní metoda pro provedení změny stavu relé."""
-        if not deditec_driver_available:
-            logging.warning("Executing relay command in DUMMY mode.")
-            # Simulace logiky zapamatování stavu
-            new_pins_state = get_new_pins_on(pins_to_turn_on, pins_to_turn_off, all_off=False)
-            save_new_pins_on(new_pins_state)
-            logging.info(f"Dummy Relay state updated. Currently ON: {new_pins_state}")
-            return True
-
         try:
-            # 1. Zjistit nový celkový stav
-            new_pins_state = get_new_pins_on(pins_to_turn_on, pins_to_turn_off, all_off=False)
-            logging.debug(f"Calculating new relay state: Request ON={pins_to_turn_on}, Request OFF={pins_to_turn_off} -> New total ON state: {new_pins_state}")
-
-            # 2. Připravit command
-            command_bytes = turn_on_pins_command(new_pins_state)
-            logging.debug(f"Generated command bytes: {command_bytes!r}")
-
-            # 3. Odeslat command
-            logging.debug(f"Connecting to Deditec at {self.ip_address}:{self.port} to send command...")
-            with Deditec_1_16_on(ip=self.ip_address, port=self.port, timeout_seconds=3) as controller: # Timeout pro spojení
-                response = controller.send_command(command_bytes) # Použije timeout socketu definovaný v Deditec_1_16_on
-
-            # 4. Zkontrolovat a uložit
-            if response == 0:
-                logging.debug("Command sent successfully. Saving new state to cache.")
-                save_new_pins_on(new_pins_state)
-                logging.info(f"Relay state updated. Currently ON: {get_pins_on()}") # Zobrazit aktuální stav z cache
-                return True
-            else:
-                logging.error(f"Deditec device returned unexpected response code: {response}")
-                return False
+            with self._session_lock: # Výpočet nového stavu, odeslání a uložení cache musí proběhnout atomicky
+                # 1. Zjistit nový celkový stav
+                new_pins_state = get_new_pins_on(pins_to_turn_on, pins_to_turn_off, all_off=False)
+                logging.debug("Calculating new relay state: Request ON=%s, Request OFF=%s -> New total ON state: %s", pins_to_turn_on, pins_to_turn_off, new_pins_state)
+
+                # 2. Připravit command
+                command_bytes = turn_on_pins_command(new_pins_state)
+                logging.debug("Generated command bytes: %r", command_bytes)
+
+                # 3. Odeslat command (přes perzistentní spojení)
+                response = self._send_on_session(command_bytes) # Použije timeout socketu definovaný v Deditec_1_16_on
+
+                # 4. Zkontrolovat a uložit
+                if response == 0:
+                    logging.debug("Command sent successfully. Saving new state to cache.")
+                    save_new_pins_on(new_pins_state)
+                    logging.info(f"Relay state updated. Currently ON: {get_pins_on()}") # Zobrazit aktuální stav z cache
+                    return True
+                else:
+                    logging.error(f"Deditec device returned unexpected response code: {response}")
+                    return False
 
         except ConnectionError as e: logging.error(f"Failed to connect to Deditec at {self.ip_address}: {e}"); return False
         except TimeoutError: logging.error(f"Timeout communicating with Deditec at {self.ip_address}"); return False
         except Exception as e: logging.exception(f"An unexpected error occurred during relay operation: {e}"); return False
 
+    def _ping_dummy(self) -> bool:
+        """DUMMY varianta ping() - bez driveru není k čemu se připojit."""
+        return True
+
+    def _execute_dummy_relay_command(self, pins_to_turn_on: List[int], pins_to_turn_off: List[int]) -> bool:
+        """DUMMY varianta _execute_relay_command() - pouze simuluje logiku zapamatování stavu."""
+        logging.warning("Executing relay command in DUMMY mode.")
+        new_pins_state = get_new_pins_on(pins_to_turn_on, pins_to_turn_off, all_off=False)
+        save_new_pins_on(new_pins_state)
+        logging.info(f"Dummy Relay state updated. Currently ON: {new_pins_state}")
+        return True
+
+    # Dostupnost driveru je známá už při importu - variantu zvolíme jednou, ne větvením při každém volání
+    if not deditec_driver_available:
+        ping = _ping_dummy
+        _execute_relay_command = _execute_dummy_relay_command
+
     # --- NOVÁ VEŘEJNÁ METODA (doplněná o validaci) ---
     def set_multiple_relays(self, pins_to_turn_on: Optional[List[int]] = None,
                             pins_to_turn_off: Optional[List[int]] = None) -> bool:
@@ -173,13 +226,27 @@ class RelayController:
         if success: time.sleep(0.5)
         return success
 
+    def apply_state(self, usb: bool, charger_hw: bool) -> bool:
+        """
+        Nastaví USB napájení i HW enable nabíječky jedním příkazem (jeden zápis do desky, jedna pauza na ustálení)
+        místo dvojice connect/disconnect_usb + enable/disable_charger_hw.
+        """
+        pins_on, pins_off = [], []
+        (pins_on if usb else pins_off).extend(self.usb_power_pins)
+        (pins_on if charger_hw else pins_off).extend(self.charger_enable_pins)
+        if not pins_on and not pins_off: return True # Nic ke spínání
+        logging.info(f"Setting relays: USB={'ON' if usb else 'OFF'}, Charger HW={'ON' if charger_hw else 'OFF'}...")
+        success = self.set_multiple_relays(pins_to_turn_on=pins_on, pins_to_turn_off=pins_off)
+        if success: time.sleep(0.5)
+        return success
+
     def beep(self, duration_ms: int = 100) -> bool:
         """Krátce zapne a vypne VŠECHNY nakonfigurované bzučáky."""
         if not self.beeper_pins:
             logging.warning("Beep requested, but no beeper_pins are configured.")
             return False
 
-        logging.debug(f"Beeping on pins {self.beeper_pins} for {duration_ms}ms...")
+        logging.debug("Beeping on pins %s for %sms...", self.beeper_pins, duration_ms)
         # Zapneme všechny bzučáky
         success_on = self.set_multiple_relays(pins_to_turn_on=self.beeper_pins)
         if success_on:
@@ -200,8 +267,9 @@ class RelayController:
          return self.set_multiple_relays(pins_to_turn_off=all_pins)
 
     def close(self):
-         """Metoda pro případné budoucí čištění (např. explicitní vypnutí všech relé)."""
+         """Zavře perzistentní spojení s deskou."""
          logging.debug("RelayController close() called.")
          # Můžeme sem přidat volitelné vypnutí všech relé při ukončení programu
          # self.turn_all_relays_off() # Odkomentuj, pokud chceš zajistit vypnutí
-         pass
\ No newline at end of file
+         with self._session_lock:
+             self._close_session()
\ No newline at end of file
@@ -26,7 +26,10 @@ class TempController:
                  relay_controller: 'RelayController | None',
                  notifications_config: dict):
         self.enabled = temp_config.get('enabled', False)
-        # ... (ostatní inicializace - stabilization_timeout, current_temp, relay_ctl, beeper_pin) ...
+        self.stabilization_timeout = temp_config.get('stabilization_timeout_seconds', 1800)
+        self.current_temp: Optional[float] = None
+        # Nová naměřená teplota se hlásí přes report_temperature(), čekající vlákna se probudí jen při změně
+        self._temp_cond = threading.Condition()
         self.relay_ctl = relay_controller
         self.beeper_pin = getattr(relay_controller, 'beeper_pin', None) if relay_controller else None
 
@@ -68,8 +71,15 @@ class TempController:
         else:
             logging.info(f"Setting temperature chamber to {target_temp_c}°C...")
             time.sleep(0.5) # Simulace
+            self.report_temperature(target_temp_c) # Simulace - komora hned hlásí cílovou teplotu
             return True
 
+    def report_temperature(self, temp_c: Optional[float]):
+        """Uloží novou naměřenou teplotu komory a probudí vlákna čekající ve wait_for_stabilization."""
+        with self._temp_cond:
+            self.current_temp = temp_c
+            self._temp_cond.notify_all()
+
     # ... (metoda _beeper_thread_func zůstává stejná) ...
     def _beeper_thread_func(self, stop_event: threading.Event, interval_s: float = 2.0, beep_duration_ms: int = 80):
         # ... (kód beze změny) ...
@@ -177,34 +187,25 @@ class TempController:
             # --- Automatický režim (zůstává stejný) ---
             # ... (kód pro automatické čekání) ...
             logging.info(f"Waiting for temperature to stabilize at {target_temp_c}°C (Timeout: {self.stabilization_timeout}s)...")
-            start_time = time.time()
-            last_log_time = 0
-            while time.time() - start_time < self.stabilization_timeout:
-                current_temp = self.get_current_temperature()
-                current_time_check = time.time()
-                if current_temp is None:
-                    logging.warning("Could not read current temperature. Check chamber connection.")
-                    time.sleep(10)
-                    continue
-                if current_time_check - last_log_time > 15:
-                     logging.info(f"  Current temperature: {current_temp:.1f}°C (Target: {target_temp_c}°C)")
-                     last_log_time = current_time_check
-                if abs(current_temp - target_temp_c) <= tolerance:
+            deadline = time.monotonic() + self.stabilization_timeout
+            in_band = lambda: self.current_temp is not None and abs(self.current_temp - target_temp_c) <= tolerance
+            with self._temp_cond:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0: break
+                    # Spíme, dokud report_temperature() nenahlásí teplotu v toleranci (nejdéle 15s kvůli průběžnému logu)
+                    if not self._temp_cond.wait_for(in_band, timeout=min(remaining, 15)):
+                        if self.current_temp is None: logging.warning("Could not read current temperature. Check chamber connection.")
+                        else: logging.info(f"  Current temperature: {self.current_temp:.1f}°C (Target: {target_temp_c}°C)")
+                        continue
                     logging.info("Temperature stabilized within tolerance.")
-                    stable_confirm_time = time.time() + 10
-                    is_stable = True
                     logging.info("  Confirming stability for 10s...")
-                    while time.time() < stable_confirm_time:
-                         confirm_temp = self.get_current_temperature()
-                         if confirm_temp is None or abs(confirm_temp - target_temp_c) > tolerance:
-                              logging.warning("  Temperature drifted out of tolerance during confirmation. Continuing wait.")
-                              is_stable = False
-                              break
-                         time.sleep(1)
-                    if is_stable:
-                         logging.info("Temperature stability confirmed.")
-                         return True
-                time.sleep(5)
+                    # Stabilní = během 10s nepřišlo žádné hlášení mimo toleranci
+                    if self._temp_cond.wait_for(lambda: not in_band(), timeout=10):
+                        logging.warning("  Temperature drifted out of tolerance during confirmation. Continuing wait.")
+                        continue
+                    logging.info("Temperature stability confirmed.")
+                    return True
             logging.error(f"Temperature did not stabilize at {target_temp_c}°C within the {self.stabilization_timeout}s timeout.")
             return False
 
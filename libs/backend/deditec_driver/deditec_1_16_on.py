@@ -62,14 +62,17 @@ class Deditec_1_16_on:
             logger.error("Deditec:: send_command called but not connected.")
             return 1 # Chyba - není připojeno
 
-        logger.debug(f"Deditec:: sending command: {command!r}")
+        logger.debug("Deditec:: sending command: %r", command)
         try:
             self.socket.sendall(command)
             # Čekání na odpověď (očekává se nějaká?)
             # Původní kód četl data, i když je nepoužíval. Zkusíme to také.
             # Velikost bufferu může být malá, pokud neočekáváme velkou odpověď.
             data = self.socket.recv(64) # Přečíst malou odpověď
-            logger.debug(f"Deditec:: received confirmation data (len={len(data)}): {data!r}")
+            if not data: # Zařízení spojení zavřelo (relevantní u perzistentního spojení)
+                logger.error("Deditec:: connection closed by device")
+                return 4 # Chyba - spojení zavřeno
+            logger.debug("Deditec:: received confirmation data (len=%d): %r", len(data), data)
             return 0 # Předpokládáme úspěch, pokud sendall a recv nehodily výjimku
         except socket.timeout:
              logger.error(f"Deditec:: socket timeout during send/recv ({self.timeout_seconds}s)")
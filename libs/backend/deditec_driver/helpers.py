@@ -89,7 +89,7 @@ def save_new_pins_on(pins_on: list[int]) -> None:
     """Uloží nový seznam zapnutých pinů do cache souboru."""
     # Odstranit duplicity a seřadit pro konzistenci
     unique_sorted_pins = sorted(list(set(pins_on)))
-    logger.debug(f"Saving new pins state to cache: {unique_sorted_pins}")
+    logger.debug("Saving new pins state to cache: %s", unique_sorted_pins)
     try:
         with open(CACHE_FILE, "w") as f:
             cache: Cache = {"last_run": datetime.now().isoformat(), "pins_on": unique_sorted_pins}
@@ -105,14 +105,14 @@ def get_new_pins_on(on: list[int], off: list[int], all_off: bool) -> list[int]:
 
     # Získáme předchozí stav z cache
     previous_on_set = set(get_pins_on())
-    logger.debug(f"Calculating new state: Previous ON={previous_on_set}, Requested ON={on}, Requested OFF={off}")
+    logger.debug("Calculating new state: Previous ON=%s, Requested ON=%s, Requested OFF=%s", previous_on_set, on, off)
 
     # Aplikujeme změny
     current_on_set = (previous_on_set.union(set(on))) - set(off)
 
     # Vrátíme jako seřazený seznam
     new_pins = sorted(list(current_on_set))
-    logger.debug(f"Resulting new ON state: {new_pins}")
+    logger.debug("Resulting new ON state: %s", new_pins)
     return new_pins
 
 
@@ -129,7 +129,7 @@ def turn_on_pins_command(pins: list[int]) -> bytes:
         else:
              logger.warning(f"Invalid pin number provided to turn_on_pins_command: {pin}. Ignoring.")
 
-    logger.debug(f"Generating command for pins: {sorted(list(valid_pins))}. Mask value: {pin_mask_value}")
+    logger.debug("Generating command for pins: %s. Mask value: %s", sorted(valid_pins), pin_mask_value)
     # Hodnota masky se přidá jako 2 bajty (big-endian) za prefix
     command = PREFIX_CMD + pin_mask_value.to_bytes(2, byteorder="big")
     return command
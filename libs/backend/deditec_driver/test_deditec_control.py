@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import sys
 import logging # Použijeme standardní logger
@@ -15,14 +16,16 @@ except ImportError:
 # Naše moduly - relativní a absolutní importy
 try:
     # Importy z aktuálního balíčku (deditec_driver)
-    from .deditec_1_16_on import Deditec_1_16_on
+    from .deditec_1_16_on import (
+        Deditec_1_16_on,
+        PORT as DEDITEC_PORT, # Přidáno pro zobrazení portu
+        IP as DEFAULT_IP # Přidáno pro zobrazení/použití výchozí IP
+    )
     from .helpers import (
         get_new_pins_on,
         save_new_pins_on,
         turn_on_pins_command,
         get_pins_on, # Přidáno pro zobrazení stavu
-        DEDITEC_PORT, # Přidáno pro zobrazení portu
-        IP as DEFAULT_IP # Přidáno pro zobrazení/použití výchozí IP
     )
     # Import z nadřazeného balíčku (backend)
     from backend.common import RunResultType, get_logger # RunResultType je Tuple[int, Dict]
@@ -45,11 +48,11 @@ else:
     logger = get_logger(__name__)
 # ---------------
 
-def run(ip_address: str, on: str = "", off: str = "", all_off: bool = False) -> RunResultType:
-    """Logika pro ovládání relé z CLI."""
-    if not imports_ok:
-         return 1, {"error": "Core dependencies not loaded."}
+ASYNC_TIMEOUT_S = 5 # Timeout pro spojení i odpověď v asynchronní variantě
+
 
+def _prepare_command(on: str, off: str, all_off: bool) -> tuple[RunResultType | None, list[int], list[int], bytes]:
+    """Zparsuje piny a sestaví příkaz. Vrací (chyba | None, předchozí stav, nový stav, příkaz)."""
     try:
         # Zparsovat čísla pinů z řetězců
         on_list = [int(num) for num in on.split(",") if num.strip().isdigit()] if on else []
@@ -58,26 +61,48 @@ def run(ip_address: str, on: str = "", off: str = "", all_off: bool = False) ->
     except ValueError:
         # Toto by nemělo nastat díky isdigit(), ale pro jistotu
         logger.error(f"Invalid PIN numbers format - on: '{on}', off: '{off}'")
-        return 1, {"error": "Invalid PIN numbers format."}
+        return (1, {"error": "Invalid PIN numbers format."}), [], [], b""
 
     if not on_list and not off_list and not all_off:
         logger.error("No valid PINs or --all_off specified.")
         current_pins = get_pins_on()
         logger.info(f"Current cached state ON: {current_pins}")
-        return 1, {"error": "No operation specified.", "current_pins_on": current_pins}
+        return (1, {"error": "No operation specified.", "current_pins_on": current_pins}), current_pins, current_pins, b""
 
     # Získat předchozí stav pro logování
     previous_pins = get_pins_on()
     logger.info(f"Previous cached state ON: {previous_pins}")
 
-    try:
-        # 1. Vypočítat nový stav
-        new_pins_on = get_new_pins_on(on_list, off_list, all_off)
-        logger.info(f"Calculated new state ON: {new_pins_on}")
+    # 1. Vypočítat nový stav
+    new_pins_on = get_new_pins_on(on_list, off_list, all_off)
+    logger.info(f"Calculated new state ON: {new_pins_on}")
+
+    # 2. Vytvořit příkaz
+    command = turn_on_pins_command(new_pins_on)
+    logger.debug(f"Generated command: {command!r}")
+    return None, previous_pins, new_pins_on, command
 
-        # 2. Vytvořit příkaz
-        command = turn_on_pins_command(new_pins_on)
-        logger.debug(f"Generated command: {command!r}")
+
+def _finish(response: int, previous_pins: list[int], new_pins_on: list[int]) -> RunResultType:
+    """Zpracuje odpověď zařízení a případně uloží nový stav do cache."""
+    if response == 0:
+        logger.info("Command sent successfully. Saving new state.")
+        save_new_pins_on(new_pins_on) # Uložit nový stav do cache
+        logger.info(f"New cached state ON: {new_pins_on}")
+        return 0, {"pins_on_before": previous_pins, "pins_on_after": new_pins_on} # Vrátíme úspěch a stavy
+    logger.error(f"Deditec device returned unexpected response code: {response}")
+    return 1, {"error": f"Deditec response code: {response}"}
+
+
+def run(ip_address: str, on: str = "", off: str = "", all_off: bool = False) -> RunResultType:
+    """Logika pro ovládání relé z CLI."""
+    if not imports_ok:
+         return 1, {"error": "Core dependencies not loaded."}
+
+    try:
+        error, previous_pins, new_pins_on, command = _prepare_command(on, off, all_off)
+        if error is not None:
+            return error
 
         # 3. Odeslat příkaz
         logger.info(f"Connecting to {ip_address}:{DEDITEC_PORT}...")
@@ -85,14 +110,7 @@ def run(ip_address: str, on: str = "", off: str = "", all_off: bool = False) ->
             response = controller.send_command(command)
 
         # 4. Zpracovat výsledek
-        if response == 0:
-            logger.info("Command sent successfully. Saving new state.")
-            save_new_pins_on(new_pins_on) # Uložit nový stav do cache
-            logger.info(f"New cached state ON: {new_pins_on}")
-            return 0, {"pins_on_before": previous_pins, "pins_on_after": new_pins_on} # Vrátíme úspěch a stavy
-        else:
-            logger.error(f"Deditec device returned unexpected response code: {response}")
-            return 1, {"error": f"Deditec response code: {response}"}
+        return _finish(response, previous_pins, new_pins_on)
 
     except ConnectionError as e:
         logger.error(f"Failed to connect to Deditec at {ip_address}: {e}")
@@ -104,14 +122,56 @@ def run(ip_address: str, on: str = "", off: str = "", all_off: bool = False) ->
         logger.exception(f"Deditec:: unexpected error during run: {e}")
         return 1, {"error": f"Unexpected error: {e}"}
 
+
+async def run_async(ip_address: str, on: str = "", off: str = "", all_off: bool = False) -> RunResultType:
+    """Stejné jako run(), ale přes asyncio - více desek lze ovládat souběžně z jednoho vlákna."""
+    if not imports_ok:
+         return 1, {"error": "Core dependencies not loaded."}
+
+    try:
+        error, previous_pins, new_pins_on, command = _prepare_command(on, off, all_off)
+        if error is not None:
+            return error
+
+        logger.info(f"Connecting to {ip_address}:{DEDITEC_PORT}...")
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip_address, DEDITEC_PORT),
+                                                timeout=ASYNC_TIMEOUT_S)
+        try:
+            writer.write(command)
+            await writer.drain()
+            data = await asyncio.wait_for(reader.read(64), timeout=ASYNC_TIMEOUT_S)
+            if not data: # Zařízení spojení zavřelo - stav v cache neměnit (jako sync send_command)
+                logger.error("Deditec:: connection closed by device")
+                return _finish(4, previous_pins, new_pins_on)
+            logger.debug("Deditec:: received confirmation data (len=%d): %r", len(data), data)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+        return _finish(0, previous_pins, new_pins_on)
+
+    except TimeoutError:
+        logger.error(f"Timeout communicating with Deditec at {ip_address}")
+        return 1, {"error": "TimeoutError"}
+    except OSError as e:
+        logger.error(f"Failed to connect to Deditec at {ip_address}: {e}")
+        return 1, {"error": f"ConnectionError: {e}"}
+    except Exception as e:
+        logger.exception(f"Deditec:: unexpected error during run: {e}")
+        return 1, {"error": f"Unexpected error: {e}"}
+
+
+async def _run_many(ip_addresses: tuple[str, ...], on: str, off: str, all_off: bool) -> list[RunResultType]:
+    return await asyncio.gather(*(run_async(ip, on, off, all_off) for ip in ip_addresses))
+
 # --- CLI rozhraní pomocí Click ---
 @click.command()
-@click.option("--ip", type=str, default=DEFAULT_IP, help=f"IP address of the Deditec device (default: {DEFAULT_IP})")
+@click.option("--ip", type=str, multiple=True, default=(DEFAULT_IP,), help=f"IP address of the Deditec device, repeat for more devices (default: {DEFAULT_IP})")
 @click.option("--on", type=str, default="", help="Comma-separated PINs to turn ON (e.g., '1,3,5')")
 @click.option("--off", type=str, default="", help="Comma-separated PINs to turn OFF (e.g., '2,4')")
 @click.option("--all_off", is_flag=True, default=False, help="Turn all PINs OFF")
 @click.option("--status", is_flag=True, default=False, help="Show current cached status and exit")
-def main(ip: str, on: str, off: str, all_off: bool, status: bool) -> None:
+def main(ip: tuple[str, ...], on: str, off: str, all_off: bool, status: bool) -> None:
     """Simple CLI to control Deditec relays."""
     if not imports_ok:
          print("ERROR: Core dependencies could not be loaded. Exiting.", file=sys.stderr)
@@ -123,7 +183,13 @@ def main(ip: str, on: str, off: str, all_off: bool, status: bool) -> None:
         sys.exit(0)
 
     # Jinak provedeme akci
-    returncode, result_dict = run(ip_address=ip, on=on, off=off, all_off=all_off)
+    if len(ip) == 1:
+        returncode, result_dict = run(ip_address=ip[0], on=on, off=off, all_off=all_off)
+    else:
+        # Více desek - příkazy běží souběžně, celkový čas ~ nejpomalejší deska
+        results = asyncio.run(_run_many(ip, on, off, all_off))
+        returncode = max(code for code, _ in results)
+        result_dict = {address: result for address, (_, result) in zip(ip, results)}
 
     # Vytisknout výsledek jako JSON pro případné strojové zpracování
     if result_dict:
@@ -1,8 +1,12 @@
 import serial
+import os
+import sys
 import time
+import selectors
 import logging # Použijeme logging pro lepší kontrolu
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Sequence
 
 BAUDRATE_DEFAULT = 115200
 BYTESIZE_DEFAULT = serial.EIGHTBITS # Použít konstantu z pyserial
@@ -10,6 +14,13 @@ PARITY_DEFAULT   = serial.PARITY_NONE
 STOPBITS_DEFAULT = serial.STOPBITS_ONE
 CMD_TIMEOUT_S    = 10 # Timeout pro čtení řádku
 
+# Klasifikace řádku odpovědi podle prvního bajtu (jeden indexovaný přístup místo řetězení startswith)
+# OK/ERROR se hledají jako podřetězec kdekoli v řádku, takže je tabulka nerozlišuje
+_TAG_OTHER, _TAG_TRACE, _TAG_PROGRESS = range(3)
+_TAG = bytearray(256)
+_TAG[ord('#')] = _TAG_TRACE
+_TAG[ord('P')] = _TAG_PROGRESS
+
 # Nastavení loggeru pro tento modul
 logger = logging.getLogger(__name__)
 # logger.setLevel(logging.DEBUG) # Pro detailní ladění komunikace
@@ -26,8 +37,11 @@ class ProdtestResponse:
 
 class prodtest_cli():
 
-    def __init__(self, device, baudrate=BAUDRATE_DEFAULT, verbose=False):
+    def __init__(self, device, baudrate=BAUDRATE_DEFAULT, verbose=False, requires_drain=False):
         self.verbose = verbose # verbose řídí jen print výstup této třídy
+        # tcdrain() po každém zápisu jen pokud to zařízení opravdu vyžaduje,
+        # následný readline() stejně blokuje až do příchodu odpovědi
+        self._requires_drain = requires_drain
         self.vcp: serial.Serial | None = None # Lepší typování
         logger.info(f"Initializing prodtest_cli for {device} at {baudrate} baud.")
         try:
@@ -74,59 +88,30 @@ class prodtest_cli():
             return response
 
         response = ProdtestResponse()
-        response.timestamp = time.time()
-
-        # Sestavení příkazu
-        command_parts = [cmd] + [str(k) for k in args]
-        full_cmd_str = ' '.join(command_parts)
-        response.cmd_sent = full_cmd_str # Uložíme celý příkaz
-        cmd_to_send = full_cmd_str + '\n' # Přidáme nový řádek
 
         try:
-            # Vyprázdnit buffery před odesláním/čtením
-            self.vcp.reset_input_buffer()
-            self.vcp.reset_output_buffer()
-
-            self._log_output(cmd_to_send)
-            self.vcp.write(cmd_to_send.encode('ascii', errors='ignore')) # Posíláme jako ASCII
-            self.vcp.flush() # Zajistit odeslání
+            full_cmd_str = self._write_command(response, cmd, *args)
 
             if skip_response:
                 response.OK = True # Předpokládáme úspěch, když nečekáme odpověď
                 return response
 
             # Čtení odpovědi řádek po řádku s timeoutem
+            # Metody navážeme na lokální jména mimo smyčku (LOAD_FAST místo LOAD_ATTR na každý řádek)
+            readline = self.vcp.readline
+            handle_line = self._handle_line
             while True:
                 try:
                     # readline() používá timeout nastavený v konstruktoru
-                    line_bytes = self.vcp.readline()
+                    line_bytes = readline()
                     if not line_bytes:
                         # Timeout! readline() vrátilo prázdné byty
                         logger.warning(f"Timeout waiting for response after command: {full_cmd_str}")
                         response.error_message = "Timeout waiting for response"
                         break # Ukončíme smyčku
 
-                    # Dekódovat s ošetřením chyb
-                    line = line_bytes.decode('ascii', errors='replace').strip()
-                    response.raw_lines.append(line) # Uložíme syrový řádek
-                    self._log_input(line)
-
-                    # Parsování odpovědi
-                    if not line: continue # Přeskočit prázdné řádky
-
-                    if line.startswith("#"): # Traces
-                        response.trace.append(line[1:].strip())
-                    elif line.startswith("PROGRESS"): # Data
-                        data_part = line[len("PROGRESS"):].strip()
-                        if data_part:
-                             response.data_entries.append(data_part.split(" ")) # Rozdělit podle mezer
-                    elif "OK" in line:
-                        response.OK = True
-                        break # Úspěšné ukončení
-                    elif "ERROR" in line:
-                         response.error_message = line # Uložíme chybový řádek
-                         logger.warning(f"Received ERROR response: {line}")
-                         break # Chyba
+                    if handle_line(response, line_bytes):
+                        break # OK nebo ERROR ukončuje odpověď
 
                 except serial.SerialException as e:
                     logger.error(f"SerialException during readline: {e}")
@@ -147,13 +132,141 @@ class prodtest_cli():
 
         return response
 
+    def _write_command(self, response: ProdtestResponse, cmd: str, *args) -> str:
+        """Sestaví a odešle příkaz, vrátí jeho textovou podobu (bez konce řádku)."""
+        response.timestamp = time.time()
+
+        # Sestavení příkazu
+        command_parts = [cmd] + [str(k) for k in args]
+        full_cmd_str = ' '.join(command_parts)
+        response.cmd_sent = full_cmd_str # Uložíme celý příkaz
+        cmd_to_send = full_cmd_str + '\n' # Přidáme nový řádek
+
+        # Vyprázdnit buffery před odesláním/čtením
+        self.vcp.reset_input_buffer()
+        self.vcp.reset_output_buffer()
+
+        self._log_output(cmd_to_send)
+        self.vcp.write(cmd_to_send.encode('ascii', errors='ignore')) # Posíláme jako ASCII
+        if self._requires_drain:
+            self.vcp.flush() # Počkat na fyzické odeslání všech bajtů
+        return full_cmd_str
+
+    def _handle_line(self, response: ProdtestResponse, line_bytes: bytes) -> bool:
+        """Zpracuje jeden řádek odpovědi. Vrací True, pokud řádek odpověď ukončuje."""
+        line_b = line_bytes.strip()
+        # Dekódovat s ošetřením chyb
+        line = line_b.decode('ascii', errors='replace')
+        response.raw_lines.append(line) # Uložíme syrový řádek
+        self._log_input(line)
+
+        # Parsování odpovědi
+        if not line_b: return False # Přeskočit prázdné řádky
+
+        tag = _TAG[line_b[0]]
+        if tag == _TAG_TRACE: # Traces
+            response.trace.append(line[1:].strip())
+        elif tag == _TAG_PROGRESS and line_b.startswith(b"PROGRESS"): # Data
+            data_part = line[len("PROGRESS"):].strip()
+            if data_part:
+                 response.data_entries.append(data_part.split(" ")) # Rozdělit podle mezer
+        elif b"OK" in line_b:
+            response.OK = True
+            return True # Úspěšné ukončení
+        elif b"ERROR" in line_b:
+             response.error_message = line # Uložíme chybový řádek
+             logger.warning(f"Received ERROR response: {line}")
+             return True # Chyba
+        return False
+
     def _log_output(self, message):
         # Logujeme přes standardní logger, ne print
-        logger.debug(f'OUT > {message.strip()}')
+        logger.debug('OUT > %s', message.strip())
         if(self.verbose): # Pokud je verbose, tiskne i na konzoli
             print(f'[{time.strftime("%H:%M:%S")}] VCP OUT > {message.strip()}')
 
     def _log_input(self, message):
-        logger.debug(f'IN  < {message.strip()}')
+        logger.debug('IN  < %s', message.strip())
         if(self.verbose):
              print(f'[{time.strftime("%H:%M:%S")}] VCP IN  < {message.strip()}')
+
+
+class MultiProdtest():
+    """
+    Obsluhuje více prodtest_cli instancí (více DUT) z jednoho vlákna.
+
+    Na POSIX systémech registruje deskriptory všech sériových portů
+    v jednom selectoru a odpovědi čte podle připravenosti. Na Windows
+    sériové porty selektovat nelze, proto se použije vlákno na port.
+    """
+
+    READ_CHUNK = 4096
+
+    def __init__(self, clis: Sequence[prodtest_cli]):
+        self.clis = list(clis)
+
+    def send_command(self, cmd: str, *args, timeout: float = CMD_TIMEOUT_S) -> List[ProdtestResponse]:
+        """Odešle stejný příkaz všem DUT a vrátí odpovědi ve stejném pořadí."""
+        if sys.platform == "win32":
+            return self._send_command_threaded(cmd, *args)
+        return self._send_command_selector(cmd, *args, timeout=timeout)
+
+    def _send_command_threaded(self, cmd: str, *args) -> List[ProdtestResponse]:
+        with ThreadPoolExecutor(max_workers=max(1, len(self.clis))) as pool:
+            futures = [pool.submit(cli.send_command, cmd, *args) for cli in self.clis]
+            return [f.result() for f in futures]
+
+    def _send_command_selector(self, cmd: str, *args, timeout: float) -> List[ProdtestResponse]:
+        responses = [ProdtestResponse() for _ in self.clis]
+        pending = 0
+
+        with selectors.DefaultSelector() as sel:
+            for cli, response in zip(self.clis, responses):
+                if cli.vcp is None or not cli.vcp.is_open:
+                    logger.error("VCP not initialized or closed.")
+                    response.error_message = "VCP not initialized or closed"
+                    continue
+                try:
+                    cli._write_command(response, cmd, *args)
+                    # data: [cli, odpověď, buffer nedokončeného řádku]
+                    sel.register(cli.vcp.fileno(), selectors.EVENT_READ, [cli, response, b""])
+                    pending += 1
+                except (serial.SerialException, OSError) as e:
+                    logger.error(f"SerialException during command send/flush: {e}")
+                    response.error_message = f"SerialException: {e}"
+
+            deadline = time.monotonic() + timeout
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for key, _ in sel.select(remaining):
+                    cli, response, buf = key.data
+                    try:
+                        chunk = os.read(key.fd, self.READ_CHUNK)
+                    except OSError as e:
+                        logger.error(f"SerialException during readline: {e}")
+                        response.error_message = f"SerialException: {e}"
+                        chunk = b""
+                    if not chunk and response.error_message is None:
+                        response.error_message = "Serial port closed"
+                    done = not chunk
+                    lines = (buf + chunk).split(b"\n")
+                    key.data[2] = lines.pop() # Neúplný konec řádku si necháme na příště
+                    handle_line = cli._handle_line
+                    for line_bytes in lines:
+                        if handle_line(response, line_bytes):
+                            done = True
+                            break
+                    if done:
+                        sel.unregister(key.fd)
+                        pending -= 1
+
+            # Kdo neodpověděl do timeoutu
+            for key in list(sel.get_map().values()):
+                cli, response, _ = key.data
+                logger.warning(f"Timeout waiting for response after command: {response.cmd_sent}")
+                response.error_message = "Timeout waiting for response"
+                sel.unregister(key.fd)
+
+        return responses
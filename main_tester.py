@@ -1,104 +1,249 @@
 # main_tester.py
 
+import atexit
 import time
-import toml
+import pickle
 import sys
 import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-import subprocess
-import platform
-import socket
-from typing import Optional, Dict, Any # Přidáno Optional, Dict, Any
+from typing import TYPE_CHECKING, Optional, Dict, Any # Přidáno Optional, Dict, Any
+# tomllib a HW ovladače se importují až při prvním použití
 
 # --- Přidání cest k modulům ---
 project_root = Path(__file__).parent
 sys.path.append(str(project_root))
 libs_path = project_root / "libs"
-if str(libs_path) not in sys.path:
-    sys.path.insert(0, str(libs_path))
 backend_path = libs_path / "backend"
-if str(backend_path) not in sys.path:
-     sys.path.insert(0, str(backend_path))
 # Cesty pro hardware_ctl, simulation, test_logic, analysis (pokud jsou potřeba přímo zde)
 hw_ctl_path = project_root / "hardware_ctl"
-if str(hw_ctl_path) not in sys.path: sys.path.insert(0, str(hw_ctl_path))
 sim_path = project_root / "simulation"
-if str(sim_path) not in sys.path: sys.path.insert(0, str(sim_path))
 logic_path = project_root / "test_logic"
-if str(logic_path) not in sys.path: sys.path.insert(0, str(logic_path))
+_existing_paths = set(sys.path) # Jedna průchozí kontrola místo lineárního hledání v sys.path pro každou cestu
+for _p in (libs_path, backend_path, hw_ctl_path, sim_path, logic_path):
+    _s = str(_p)
+    if _s not in _existing_paths:
+        sys.path.insert(0, _s)
+        _existing_paths.add(_s)
 # -----------------------------
 
-# --- Importy ovladačů a logiky ---
-try:
+# --- Importy logiky ---
+# HW ovladače (relé, komora, DUT) i testovací logika (test_steps, DataLogger) se importují až v main()
+# a run_test_cycle() - samotný `import main_tester` (např. kvůli load_config) je tak levný
+
+# Podmíněný import pro type hinting
+if TYPE_CHECKING:
+    from test_logic.data_logger import DataLogger
     from hardware_ctl.relay_controller import RelayController
     from hardware_ctl.temp_controller import TempController
-    from test_logic.data_logger import DataLogger
-    from test_logic import test_steps
-    # Import Deditec třídy pro přímý test spojení
-    from backend.deditec_driver.deditec_1_16_on import Deditec_1_16_on
-    deditec_import_ok = True
-    # Importujeme typy pro type hinting kontrolerů
     from hardware_ctl.dut_controller import DutController
     from simulation.dummy_dut_controller import DummyDutController
     DutControllerTypes = DutController | DummyDutController
-except ImportError as e:
-    print(f"FATAL ERROR: Failed to import core modules: {e}")
-    print("Please check project structure, __init__.py files, and sys.path.")
-    # Ukončení zde nemá smysl, protože logger ještě není nastaven
-    deditec_import_ok = False # Nastavíme flag pro check_peripherals
-    # Můžeme definovat dummy třídy zde, aby zbytek mohl běžet až k logování chyby
-    class RelayController: pass
-    class TempController: pass
-    class DataLogger: pass
-    class test_steps: pass
-    class DutController: pass
-    class DummyDutController: pass
-    DutControllerTypes = Any # Fallback type
 # ---------------------------------
 
 # --- Nastavení logování ---
 log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - [%(name)s] - %(message)s')
+
+try:
+    import orjson
+    _json_dumps = lambda obj: orjson.dumps(obj).decode()
+except ImportError: # orjson je volitelný - fallback na stdlib json
+    import json
+    _json_dumps = lambda obj: json.dumps(obj, ensure_ascii=False)
+
+class JsonLogFormatter(logging.Formatter):
+    """Formátuje záznam jako jeden řádek JSON (NDJSON) - rychlejší než %-formát se strftime a strojově čitelný."""
+    def format(self, record):
+        entry = {'t': record.created, 'lvl': record.levelname, 'n': record.name, 'm': record.getMessage()}
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return _json_dumps(entry)
+
+class BufferedFileHandler(logging.FileHandler):
+    """
+    FileHandler se 128 KiB bufferem, který nevolá flush() po každém záznamu (jen u ERROR a vyšších).
+    Buffer se navíc vyprázdní každých FLUSH_INTERVAL_S, aby `tail -f test_run.log` nezaostával.
+    """
+    BUFFER_SIZE = 128 * 1024
+    FLUSH_INTERVAL_S = 5.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._flush_stop = threading.Event()
+        self._flush_thread = threading.Thread(target=self._periodic_flush, name="LogFlush", daemon=True)
+        self._flush_thread.start()
+
+    def _periodic_flush(self):
+        while not self._flush_stop.wait(self.FLUSH_INTERVAL_S):
+            self.flush()
+
+    def close(self):
+        self._flush_stop.set()
+        super().close()
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.BUFFER_SIZE, encoding=self.encoding, errors=self.errors)
+
+    def emit(self, record):
+        try:
+            if self.stream is None: self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= logging.ERROR: self.stream.flush() # Chyby chceme na disku hned
+        except Exception:
+            self.handleError(record)
+
 log_file = project_root / "test_run.log"
 logger = logging.getLogger() # Root logger
-logger.setLevel(logging.INFO) # Nastavení úrovně root loggeru
-# Odstranění předchozích handlerů, pokud existují
-if logger.hasHandlers(): logger.handlers.clear()
-# File handler
-try:
-    file_handler = logging.FileHandler(log_file, mode='w', encoding='utf-8')
-    file_handler.setFormatter(log_formatter)
-    file_handler.setLevel(logging.INFO) # Logovat INFO a vyšší do souboru
-    logger.addHandler(file_handler)
-except Exception as log_e:
-     print(f"WARNING: Failed to create file log handler for {log_file}: {log_e}")
-# Console handler
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(log_formatter)
-console_handler.setLevel(logging.INFO) # Zobrazit INFO a vyšší na konzoli
-logger.addHandler(console_handler)
+log_listener: Optional[QueueListener] = None
+
+def _init_logging() -> None:
+    """
+    Nastaví root logger (soubor + konzole). Opakované volání nic nedělá, takže
+    harness volající main() víckrát znovu neotevře (a mode='w' nezkrátí) test_run.log.
+    """
+    global log_listener
+    if getattr(_init_logging, '_done', False): return
+    _init_logging._done = True
+
+    logger.setLevel(logging.INFO) # Nastavení úrovně root loggeru
+    # Odstranění předchozích handlerů, pokud existují
+    if logger.hasHandlers(): logger.handlers.clear()
+    # Handlery (soubor, konzole) běží ve vlákně QueueListeneru - logging.info() v testovací smyčce
+    # jen vloží záznam do fronty a zápis na disk/konzoli neblokuje průběh testu
+    log_handlers = []
+    # File handler
+    try:
+        file_handler = BufferedFileHandler(log_file, mode='w', encoding='utf-8', delay=True) # Soubor se otevře až při prvním záznamu
+        file_handler.setFormatter(JsonLogFormatter()) # Soubor je pro stroje (NDJSON), konzole zůstává čitelná
+        file_handler.setLevel(logging.INFO) # Logovat INFO a vyšší do souboru
+        log_handlers.append(file_handler)
+        atexit.register(file_handler.flush) # Konec logu přežije i neošetřený pád
+    except Exception as log_e:
+         print(f"WARNING: Failed to create file log handler for {log_file}: {log_e}")
+    # Console handler
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(log_formatter)
+    console_handler.setLevel(logging.INFO) # Zobrazit INFO a vyšší na konzoli
+    log_handlers.append(console_handler)
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(_stop_logging) # Registrováno po flush -> při ukončení proběhne dřív (LIFO)
+
+def _stop_logging() -> None:
+    """Zastaví QueueListener - vyprázdní frontu a zapíše zbývající záznamy. Bezpečné volat opakovaně."""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
 # -----------------------------
 
+# --- Schéma konfigurace ---
+# sekce -> {klíč: (povolené typy, výchozí hodnota nebo _REQUIRED)}; [dut_commands] je volná tabulka příkazů
+_REQUIRED = object()
+_NUMBER = (int, float)
+_CONFIG_SCHEMA: Dict[str, Dict[str, tuple]] = {
+    "general": {
+        "output_directory": (str, _REQUIRED),
+        "log_interval_seconds": (_NUMBER, _REQUIRED),
+        "simulate_dut": (bool, False),
+        "fail_fast": (bool, False),
+        "parallel_modes": (bool, False),
+        "cpu_affinity": ((int, type(None)), None),
+        "realtime_priority": ((int, type(None)), None),
+        "dut_serial_port": ((str, type(None)), None),
+    },
+    "relay": {
+        "ip_address": (str, _REQUIRED),
+        "usb_power_relay_pins": (list, []),
+        "charger_enable_relay_pins": ((list, type(None)), None),
+        "beeper_pins": ((list, type(None)), None),
+    },
+    "temperature_chamber": {
+        "enabled": (bool, False),
+        "stabilization_timeout_seconds": (_NUMBER, 1800),
+    },
+    "test_plan": {
+        "temperatures_celsius": (list, [25]),
+        "test_modes": (list, ["linear"]),
+        "cycles_per_temperature": (int, 1),
+        "relaxation_time_seconds": (_NUMBER, _REQUIRED),
+    },
+    "dut_commands": {},
+    "notifications": {
+        "manual_temp_mode": (str, "beeper"),
+        "slack_webhook_url": ((str, type(None)), None),
+    },
+}
+_CONFIG_SCHEMA_VERSION = 4 # Zvýšit při změně schématu - zneplatní pickle cache
+
+def _validate_config(config: Dict[str, Any]) -> None:
+    """Ověří konfiguraci proti _CONFIG_SCHEMA a doplní výchozí hodnoty (na místě). Chyby hlásí přes ValueError."""
+    for section, fields in _CONFIG_SCHEMA.items():
+        table = config.get(section)
+        if not isinstance(table, dict):
+            raise ValueError(f"Missing required section '{section}' in config file.")
+        for key, (types, default) in fields.items():
+            if key not in table:
+                if default is _REQUIRED:
+                    raise ValueError(f"Missing required key '{key}' in [{section}].")
+                logging.warning("Config key '%s' not found in [%s]. Assuming '%s'.", key, section, default)
+                table[key] = list(default) if isinstance(default, list) else default
+            elif not isinstance(table[key], types) or (types is _NUMBER and isinstance(table[key], bool)):
+                raise ValueError(f"Invalid type of '{key}' in [{section}]: {type(table[key]).__name__}.")
+    # Reálné DUT potřebuje sériový port - chybu hlásit hned, ne až při otevírání DUT
+    if not config['general']['simulate_dut'] and config['general']['dut_serial_port'] is None:
+        raise ValueError("Missing 'dut_serial_port' in [general] (required when simulate_dut = false).")
+
+def _load_cached_config(cache_file: Path, cache_key: tuple) -> Optional[Dict[str, Any]]:
+    """Vrátí zvalidovanou konfiguraci z pickle cache, pokud odpovídá klíči (mtime, velikost) TOML souboru."""
+    try:
+        with open(cache_file, 'rb') as f:
+            cached_key, cached_config = pickle.load(f)
+    except Exception: # Cache chybí nebo je poškozená - prostě znovu parsujeme
+        return None
+    return cached_config if cached_key == cache_key else None
+
+def _store_cached_config(cache_file: Path, cache_key: tuple, config: Dict[str, Any]) -> None:
+    """Uloží zvalidovanou konfiguraci vedle TOML souboru. Chyba zápisu není kritická."""
+    import os
+    tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    try:
+        # Zápis do dočasného souboru + os.replace - souběžný/přerušený běh nikdy neuvidí napůl zapsanou cache
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((cache_key, config), f, protocol=5)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logging.debug("Could not write config cache %s: %s", cache_file, e)
+        try: tmp_file.unlink()
+        except OSError: pass
+
 def load_config(config_path="test_config.toml") -> Optional[Dict[str, Any]]:
-    """Načte konfiguraci z TOML souboru."""
+    """Načte a zvaliduje konfiguraci z TOML souboru (s pickle cache klíčovanou mtime/velikostí souboru)."""
     config_file = project_root / config_path
+    cache_file = config_file.with_name(config_file.name + ".cache")
     logging.info(f"Loading configuration from: {config_file}")
     try:
-        config = toml.load(config_file)
-        # Validace základních sekcí
-        required_sections = ["general", "relay", "temperature_chamber", "test_plan", "dut_commands", "notifications"]
-        for section in required_sections:
-            if section not in config:
-                raise ValueError(f"Missing required section '{section}' in config file.")
-        # Doplnění defaultních hodnot, pokud chybí
-        if 'simulate_dut' not in config['general']:
-            logging.warning("Config key 'simulate_dut' not found in [general]. Assuming 'false'.")
-            config['general']['simulate_dut'] = False
-        if 'test_modes' not in config['test_plan']:
-            logging.warning("Config key 'test_modes' not found in [test_plan]. Assuming '[\"linear\"]'.")
-            config['test_plan']['test_modes'] = ['linear']
-        if 'manual_temp_mode' not in config['notifications']:
-             config['notifications']['manual_temp_mode'] = 'beeper' # Default
-
+        st = config_file.stat()
+        cache_key = (st.st_mtime_ns, st.st_size, _CONFIG_SCHEMA_VERSION)
+        config = _load_cached_config(cache_file, cache_key)
+        if config is not None:
+            logging.info("Configuration loaded from cache (source file unchanged).")
+            return config
+
+        try:
+            import tomllib # Python 3.11+
+        except ImportError:
+            import tomli as tomllib
+        with open(config_file, 'rb') as f:
+            config = tomllib.load(f)
+        _validate_config(config) # Validace + doplnění defaultů jen jednou; dál se hodnoty čtou bez .get()
+
+        _store_cached_config(cache_file, cache_key, config)
         logging.info("Configuration loaded and validated successfully.")
         return config
     except FileNotFoundError:
@@ -108,72 +253,60 @@ def load_config(config_path="test_config.toml") -> Optional[Dict[str, Any]]:
         logging.error(f"ERROR: Failed to load or parse configuration file '{config_file}': {e}")
         return None
 
-def _check_deditec_connection(ip: str, port: int, timeout: int = 2) -> bool:
-    """Pokusí se navázat TCP spojení s Deditec deskou."""
-    if not deditec_import_ok:
-        logging.warning("Deditec driver not imported, cannot perform connection check.")
-        return True # Nepovažujeme za kritickou chybu, pokud driver chybí
-
-    logging.info(f"Checking Deditec connection to {ip}:{port} (timeout={timeout}s)...")
-    try:
-        with Deditec_1_16_on(ip=ip, port=port, timeout_seconds=timeout) as tester:
-            logging.info("Deditec connection successful.")
-            return True
-    except ConnectionError as e: logging.error(f"Deditec connection failed: {e}"); return False
-    except TimeoutError: logging.error(f"Deditec connection timed out."); return False
-    except Exception as e: logging.error(f"Unexpected error during Deditec connection check: {e}"); return False
-
-def _check_ping(ip: str) -> bool:
-    """Odešle jeden ping na danou IP adresu."""
-    logging.info(f"Pinging {ip}...")
-    system = platform.system().lower()
-    if system == "windows":
-        command = ["ping", "-n", "1", "-w", "1000", ip] # Timeout 1000ms
-    else: # Linux, macOS
-        command = ["ping", "-c", "1", "-W", "1", ip] # Timeout 1s
-
-    try:
-        # Použijeme Popen pro lepší kontrolu a nezávislost na shellu
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        stdout, stderr = process.communicate(timeout=3) # Celkový timeout procesu
-        return_code = process.returncode
-        logging.debug(f"Ping stdout:\n{stdout}")
-        if stderr: logging.debug(f"Ping stderr:\n{stderr}")
-
-        if return_code == 0:
-             # Doplňková kontrola (může být závislá na jazyku systému)
-            if "unreachable" in stdout.lower() or "timed out" in stdout.lower() or "ttl expired" in stdout.lower():
-                 logging.error(f"Ping to {ip} technically succeeded (code 0) but output indicates failure.")
-                 return False
-            logging.info(f"Ping to {ip} successful.")
-            return True
+def _apply_scheduling(general_cfg: dict) -> None:
+    """
+    Volitelně připne proces na jedno CPU a přepne ho na SCHED_FIFO (jen Linux), aby vzorkování
+    DataLoggeru nerozhazovala migrace mezi jádry a preempce. SCHED_FIFO vyžaduje root nebo CAP_SYS_NICE.
+    """
+    import os
+    cpu = general_cfg['cpu_affinity']
+    priority = general_cfg['realtime_priority']
+    if cpu is not None:
+        if not hasattr(os, 'sched_setaffinity'):
+            logging.warning("'cpu_affinity' is not supported on this platform. Ignoring.")
         else:
-            logging.error(f"Ping to {ip} failed (return code: {return_code}).")
-            return False
-    except FileNotFoundError:
-        logging.error("Ping command not found. Install ping or check PATH. Skipping ping check.")
-        return True # Pokračujeme, nemůžeme ověřit
-    except subprocess.TimeoutExpired:
-        logging.error(f"Ping process to {ip} timed out.")
-        return False
-    except Exception as e:
-        logging.error(f"Error during ping check: {e}")
-        return True # Neznámá chyba, zkusíme pokračovat
+            try:
+                os.sched_setaffinity(0, {cpu})
+                logging.info(f"Process pinned to CPU {cpu}.")
+            except OSError as e:
+                logging.warning(f"Failed to pin process to CPU {cpu}: {e}")
+    if priority is not None:
+        if not hasattr(os, 'sched_setscheduler'):
+            logging.warning("'realtime_priority' is not supported on this platform. Ignoring.")
+        else:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+                logging.info(f"Process scheduling set to SCHED_FIFO (priority {priority}).")
+            except PermissionError:
+                logging.warning("Setting SCHED_FIFO requires root or CAP_SYS_NICE (e.g. 'sudo setcap cap_sys_nice+ep $(which python3)'). Using default scheduling.")
+            except OSError as e:
+                logging.warning(f"Failed to set SCHED_FIFO priority {priority}: {e}")
 
 def check_peripherals(config: dict, relay_ctl, dut_ctl, temp_ctl) -> bool:
     """Zkontroluje dostupnost nakonfigurovaných periferií."""
     logging.info("--- Starting Peripheral Checks ---")
     all_ok = True
-    is_simulation = config['general'].get('simulate_dut', False)
-    temp_enabled = config['temperature_chamber'].get('enabled', False)
+    is_simulation = config['general']['simulate_dut']
+    temp_enabled = config['temperature_chamber']['enabled']
+
+    relay_valid = bool(relay_ctl and hasattr(relay_ctl, 'ip_address')) # Ověření, zda je relay_ctl platný
+    dut_probe = not is_simulation and dut_ctl is not None and hasattr(dut_ctl, 'cli') # Zkontrolujeme i vnitřní 'cli'
+
+    # TCP spojení s Deditec a dotaz na DUT jsou nezávislé blokující I/O operace -
+    # spustíme je souběžně, celková doba = nejpomalejší z nich. Výsledky vyhodnotíme v pevném pořadí.
+    futures: Dict[str, Future] = {}
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="PeripheralCheck") as pool:
+        if relay_valid:
+            # Naváže perzistentní spojení, které pak RelayController používá pro všechny příkazy
+            futures['deditec'] = pool.submit(relay_ctl.ping)
+        if dut_probe:
+            logging.info("Real DUT Controller initialized. Attempting test communication...")
+            # Zkusíme získat status - může trvat déle
+            futures['dut'] = pool.submit(dut_ctl.get_operation_mode)
 
     # 1. Kontrola Relé Desky
-    if relay_ctl and hasattr(relay_ctl, 'ip_address'): # Ověření, zda je relay_ctl platný
-        relay_ip = config['relay']['ip_address']
-        relay_port = relay_ctl.DEDITEC_PORT
-        if not _check_ping(relay_ip):
-            logging.warning("Ping to Deditec relay board failed. Network issue possible, but attempting TCP check.")
-        if not _check_deditec_connection(relay_ip, relay_port):
+    if relay_valid:
+        if not futures['deditec'].result():
             logging.error("CRITICAL: Failed to establish TCP connection with Deditec relay board.")
             all_ok = False
     else:
@@ -182,14 +315,12 @@ def check_peripherals(config: dict, relay_ctl, dut_ctl, temp_ctl) -> bool:
 
     # 2. Kontrola DUT
     if not is_simulation:
-        if dut_ctl is None or not hasattr(dut_ctl, 'cli'): # Zkontrolujeme i vnitřní 'cli'
+        if not dut_probe:
             logging.error("CRITICAL: Real DUT Controller initialization failed (check serial port, connection, and prodtest_cli).")
             all_ok = False
         else:
-            logging.info("Real DUT Controller initialized. Attempting test communication...")
             try:
-                # Zkusíme získat status - může trvat déle
-                status = dut_ctl.get_operation_mode()
+                status = futures['dut'].result()
                 if status is None:
                     logging.warning("Test communication with DUT failed or returned no data. DUT might not be ready or commands invalid.")
                     # Nepovažujeme za kritickou chybu zde, test může běžet dál
@@ -200,7 +331,8 @@ def check_peripherals(config: dict, relay_ctl, dut_ctl, temp_ctl) -> bool:
                 # Toto může být kritické
                 all_ok = False
     else: # Simulace
-        if dut_ctl is None or not hasattr(dut_ctl, '_simulate_battery'): # Ověříme dummy
+        from simulation.dummy_dut_controller import DummyDutController
+        if not isinstance(dut_ctl, DummyDutController): # Ověříme dummy
             logging.error("CRITICAL: Dummy DUT Controller failed to initialize.")
             all_ok = False
         else:
@@ -224,87 +356,106 @@ def check_peripherals(config: dict, relay_ctl, dut_ctl, temp_ctl) -> bool:
 
     return all_ok
 
+# Běžící sekvence módů jako (smyčka událostí, úloha) - Ctrl+C v hlavním vlákně je zruší i ve vláknech paralelních módů
+_active_mode_runs: set = set()
+_mode_runs_cancelled = threading.Event() # Nastaveno = nově spuštěné sekvence se rovnou zruší
+
+def _cancel_mode_runs() -> None:
+    """Zruší všechny běžící sekvence módů (volá se z jiného vlákna); kroky provedou svůj úklid."""
+    _mode_runs_cancelled.set()
+    for loop, task in list(_active_mode_runs):
+        loop.call_soon_threadsafe(task.cancel)
+
+async def _run_mode_steps(*args) -> bool:
+    """Spustí sekvenci kroků módu a po dobu běhu ji zaregistruje pro _cancel_mode_runs()."""
+    import asyncio
+    if _mode_runs_cancelled.is_set(): raise asyncio.CancelledError()
+    run = (asyncio.get_running_loop(), asyncio.current_task())
+    _active_mode_runs.add(run)
+    try:
+        return await _mode_steps(*args)
+    finally:
+        _active_mode_runs.discard(run)
+
+async def _mode_steps(test_mode: str, plan: dict, relax_s: float, relay_ctl: 'RelayController',
+                      dut_ctl: 'DutControllerTypes', cycle_logger: 'DataLogger') -> bool:
+    """Sekvence kroků jednoho módu (relaxace, kroky módu, relaxace); False = krok selhal."""
+    from test_logic import test_steps
+    step_relax = test_steps.step_relax # Lokální alias místo opakovaného hledání v modulu
+
+    # Relaxace před aktivitou specifickou pro mód
+    await step_relax(relax_s, f"Pre-{test_mode.capitalize()}")
+
+    # --- Logika specifická pro mód ---
+    if test_mode == "linear":
+        logging.info("Executing Linear Test Steps...")
+        cycle_logger.set_phase("discharge")
+        if not cycle_logger.start_logging(): return False
+        if not await test_steps.step_discharge(dut_ctl, relay_ctl, cycle_logger, plan): return False
+
+        cycle_logger.set_phase("relax")
+        if not test_steps.step_connect_usb_disable_charge(relay_ctl, dut_ctl): return False
+        await step_relax(relax_s, "Linear Pre-Charge")
+
+        cycle_logger.set_phase("charge")
+        if not test_steps.step_enable_charging(relay_ctl, dut_ctl): return False
+        if not await test_steps.step_charge(dut_ctl, cycle_logger, plan): return False
+
+    elif test_mode == "switching":
+        logging.info("Executing Switching Test Steps...")
+        cycle_logger.set_phase("switching")
+        if not cycle_logger.start_logging(): return False
+        if not await test_steps.step_switching_phase(dut_ctl, relay_ctl, cycle_logger, plan): return False
+
+    elif test_mode == "random":
+        logging.info("Executing Random Wonder Test Steps...")
+        cycle_logger.set_phase("random")
+        if not cycle_logger.start_logging(): return False
+        if not await test_steps.step_random_wonder(dut_ctl, relay_ctl, cycle_logger, plan): return False
+
+    cycle_logger.stop_logging()
+
+    # Relaxace po aktivitě specifické pro mód
+    await step_relax(relax_s, f"Post-{test_mode.capitalize()}")
+    return True
+
 def run_test_cycle(config: dict, temp_c: float, cycle_num: int, test_mode: str,
-                   temp_ctl: TempController, relay_ctl: RelayController, dut_ctl: DutControllerTypes) -> bool:
+                   temp_ctl: 'TempController', relay_ctl: 'RelayController', dut_ctl: 'DutControllerTypes',
+                   base_output_dir: Path, log_interval: float, relax_s: float,
+                   temp_confirmed: bool = False) -> bool:
     """
     Provede jeden testovací "sub-cyklus" pro daný mód, teplotu a číslo cyklu.
     Loguje do samostatných souborů pro fáze daného módu.
+    Hodnoty neměnné mezi běhy (výstupní složka, interval logování, doba relaxace) předává volající.
+    temp_confirmed=True přeskočí čekání na stabilizaci teploty (volající ji už ověřil).
     """
     logging.info(f"--- Starting Test: Mode='{test_mode}', Cycle={cycle_num + 1}, Temp={temp_c}°C ---")
-    base_output_dir = Path(config['general']['output_directory'])
-    log_interval = config['general']['log_interval_seconds']
-
-    # Připravíme si cesty k logům, ale loggery vytvoříme až při potřebě
-    temp_discharge_log_path = base_output_dir / f"_temp_{temp_c:.0f}C_cycle{cycle_num+1}_{test_mode}_discharge.csv"
-    temp_charge_log_path = base_output_dir / f"_temp_{temp_c:.0f}C_cycle{cycle_num+1}_{test_mode}_charge.csv"
-    temp_specific_log_path = base_output_dir / f"_temp_{temp_c:.0f}C_cycle{cycle_num+1}_{test_mode}_main.csv"
-
-    discharge_logger: Optional[DataLogger] = None
-    charge_logger: Optional[DataLogger] = None
-    specific_logger: Optional[DataLogger] = None
 
-    final_log_paths: Dict[str, Optional[Path]] = { # Pro sledování vytvořených logů
-        "discharge": None, "charge": None, "specific": None
-    }
+    # Jeden CSV soubor na celý běh módu; fáze (discharge/charge/...) rozlišuje sloupec 'phase'
+    import asyncio
+    from test_logic.data_logger import DataLogger
+    from test_logic import test_steps
+    plan = config['test_plan'] # Lokální alias místo opakovaného indexování configu
+    run_name = f"{temp_c:.0f}C_cycle{cycle_num+1}_{test_mode}"
+    # Logger píše rovnou do finálního umístění - po běhu se nic nepřejmenovává ani nekopíruje
+    cycle_log_path = test_steps.log_target_path(base_output_dir, temp_c, cycle_num, test_mode, f"{run_name}.csv")
+    cycle_logger: Optional['DataLogger'] = None
     cycle_successful = False
 
+    if test_mode not in ("linear", "switching", "random"):
+        logging.error(f"Unknown test mode: '{test_mode}'. Skipping.")
+        return False
+
     try:
         # Kroky společné pro všechny módy (mohou běžet před specifickou logikou)
         logging.info("Verifying/Setting temperature...")
-        if not temp_ctl.wait_for_stabilization(temp_c):
+        if not temp_confirmed and not temp_ctl.wait_for_stabilization(temp_c):
              logging.error("Temperature check/stabilization failed. Aborting test mode.")
              return False
 
-        # Relaxace před aktivitou specifickou pro mód
-        test_steps.step_relax(config['test_plan']['relaxation_time_seconds'], f"Pre-{test_mode.capitalize()}")
-
-        # --- Logika specifická pro mód ---
-        if test_mode == "linear":
-            logging.info("Executing Linear Test Steps...")
-            discharge_logger = DataLogger(dut_ctl, log_interval, temp_discharge_log_path)
-            charge_logger = DataLogger(dut_ctl, log_interval, temp_charge_log_path)
-            final_log_paths["discharge"] = temp_discharge_log_path
-            final_log_paths["charge"] = temp_charge_log_path
-
-            if not discharge_logger.start_logging(): return False
-            if not test_steps.step_discharge(dut_ctl, relay_ctl, discharge_logger, config['test_plan']):
-                 discharge_logger.stop_logging(); return False
-            discharge_logger.stop_logging()
-
-            if not test_steps.step_connect_usb_disable_charge(relay_ctl, dut_ctl): return False
-            test_steps.step_relax(config['test_plan']['relaxation_time_seconds'], "Linear Pre-Charge")
-
-            if not charge_logger.start_logging(): return False
-            if not test_steps.step_enable_charging(relay_ctl, dut_ctl):
-                 charge_logger.stop_logging(); return False
-            if not test_steps.step_charge(dut_ctl, charge_logger, config['test_plan']):
-                 charge_logger.stop_logging(); return False
-            charge_logger.stop_logging()
-
-        elif test_mode == "switching":
-            logging.info("Executing Switching Test Steps...")
-            specific_logger = DataLogger(dut_ctl, log_interval, temp_specific_log_path)
-            final_log_paths["specific"] = temp_specific_log_path
-            if not specific_logger.start_logging(): return False
-            if not test_steps.step_switching_phase(dut_ctl, relay_ctl, specific_logger, config['test_plan']):
-                 specific_logger.stop_logging(); return False
-            specific_logger.stop_logging()
-
-        elif test_mode == "random":
-            logging.info("Executing Random Wonder Test Steps...")
-            specific_logger = DataLogger(dut_ctl, log_interval, temp_specific_log_path)
-            final_log_paths["specific"] = temp_specific_log_path
-            if not specific_logger.start_logging(): return False
-            if not test_steps.step_random_wonder(dut_ctl, relay_ctl, specific_logger, config['test_plan']):
-                 specific_logger.stop_logging(); return False
-            specific_logger.stop_logging()
-
-        else:
-            logging.error(f"Unknown test mode: '{test_mode}'. Skipping.")
-            return False
-
-        # Relaxace po aktivitě specifické pro mód
-        test_steps.step_relax(config['test_plan']['relaxation_time_seconds'], f"Post-{test_mode.capitalize()}")
+        cycle_logger = DataLogger(dut_ctl, log_interval, cycle_log_path)
+        # Kroky módu jsou korutiny - jedna smyčka událostí na běh módu (v paralelním režimu každé vlákno svou)
+        if not asyncio.run(_run_mode_steps(test_mode, plan, relax_s, relay_ctl, dut_ctl, cycle_logger)): return False
 
         logging.info(f"--- Test Mode '{test_mode}' Completed Successfully (Cycle {cycle_num + 1}, Temp {temp_c}°C) ---")
         cycle_successful = True
@@ -314,25 +465,72 @@ def run_test_cycle(config: dict, temp_c: float, cycle_num: int, test_mode: str,
         logging.exception(f"Unexpected error during test mode '{test_mode}' (Cycle {cycle_num + 1}, Temp {temp_c}°C): {e}")
         return False # Cyklus selhal
     finally:
-        # Ukončení loggerů, pokud ještě běží (např. po výjimce)
-        if discharge_logger and discharge_logger.is_logging: discharge_logger.stop_logging()
-        if charge_logger and charge_logger.is_logging: charge_logger.stop_logging()
-        if specific_logger and specific_logger.is_logging: specific_logger.stop_logging()
-
-        # Uložení/Přejmenování souborů
-        output_storage_dir = Path(config['general']['output_directory'])
-        if final_log_paths["discharge"]:
-            stored = test_steps.step_store_files(final_log_paths["discharge"], output_storage_dir, temp_c, cycle_num, f"{test_mode}_discharge")
-            if stored and stored != final_log_paths["discharge"]: logging.info(f"Discharge log stored as: {stored.name}")
-        if final_log_paths["charge"]:
-             stored = test_steps.step_store_files(final_log_paths["charge"], output_storage_dir, temp_c, cycle_num, f"{test_mode}_charge")
-             if stored and stored != final_log_paths["charge"]: logging.info(f"Charge log stored as: {stored.name}")
-        if final_log_paths["specific"]:
-             stored = test_steps.step_store_files(final_log_paths["specific"], output_storage_dir, temp_c, cycle_num, f"{test_mode}_main")
-             if stored and stored != final_log_paths["specific"]: logging.info(f"Specific log for '{test_mode}' stored as: {stored.name}")
+        # Ukončení loggeru, pokud ještě běží (např. po výjimce) - stop_logging() je idempotentní
+        if cycle_logger:
+            cycle_logger.stop_logging()
+            # Soubor už leží ve finálním umístění - step_store_files ho přesune jen pokud logger psal jinam
+            if cycle_logger.logged_data_file:
+                stored = test_steps.step_store_files(cycle_logger.logged_data_file, base_output_dir, temp_c, cycle_num, test_mode,
+                                                     target_name=f"{run_name}.csv")
+                if stored and stored != cycle_logger.logged_data_file: logging.info(f"Log for '{test_mode}' stored as: {stored.name}")
+
+def _close_controllers(relay_ctl, dut_ctl, temp_ctl) -> None:
+    """Zavře všechny inicializované ovladače; chyba jednoho nezabrání zavření ostatních."""
+    for name, ctl in (("relay", relay_ctl), ("DUT controller", dut_ctl), ("Temperature controller", temp_ctl)):
+        if ctl:
+            try: ctl.close()
+            except Exception as e: logging.error(f"Error during {name} cleanup: {e}")
+
+def _run_modes_serial(config: dict, temp_c: float, cycle_num: int, test_modes: list,
+                      temp_ctl, relay_ctl, dut_ctl, *run_args):
+    """Spouští módy jeden po druhém; generátor - po přerušení iterace (fail_fast) se další mód nespustí."""
+    for test_mode in test_modes:
+        run_start_time = time.time()
+        logging.info(f"  -- Running Test Mode: '{test_mode}' --")
+        # Předáme všechny ovladače a konfiguraci
+        success = run_test_cycle(config, temp_c, cycle_num, test_mode, temp_ctl, relay_ctl, dut_ctl, *run_args)
+        yield test_mode, success, (time.time() - run_start_time) / 60
+
+def _run_modes_parallel(config: dict, temp_c: float, cycle_num: int, test_modes: list,
+                        temp_ctl, relay_ctl, dut_ctl, *run_args):
+    """
+    Spustí všechny módy cyklu souběžně (jen simulace). Každý mód dostane vlastní Dummy DUT,
+    aby se simulované baterie neovlivňovaly; teplota se potvrdí jednou pro všechny módy.
+    Všechna DUT běží v jedné farmě - jedno simulační vlákno je posouvá společným vektorovým krokem.
+    """
+    from simulation.dummy_dut_controller import DummyDutController, DummyDutFarm
+    if not temp_ctl.wait_for_stabilization(temp_c):
+        logging.error("Temperature check/stabilization failed. Aborting test modes.")
+        for test_mode in test_modes: yield test_mode, False, 0.0
+        return
+
+    def timed_run(test_mode: str, mode_dut) -> tuple:
+        run_start_time = time.time()
+        success = run_test_cycle(config, temp_c, cycle_num, test_mode, temp_ctl, relay_ctl, mode_dut,
+                                 *run_args, temp_confirmed=True)
+        return success, (time.time() - run_start_time) / 60
+
+    logging.info(f"  -- Running Test Modes in parallel: {test_modes} --")
+    farm = DummyDutFarm(len(test_modes))
+    mode_duts = [DummyDutController(config['dut_commands'], farm=farm, index=k) for k in range(len(test_modes))]
+    _mode_runs_cancelled.clear()
+    try:
+        with ThreadPoolExecutor(max_workers=len(test_modes), thread_name_prefix="TestMode") as pool:
+            try:
+                results = list(pool.map(timed_run, test_modes, mode_duts))
+            except KeyboardInterrupt:
+                # Bez zrušení by výstup z `with` čekal, než módy ve vláknech doběhnou (hodiny)
+                logging.warning("Interrupt received - cancelling parallel test modes...")
+                _cancel_mode_runs()
+                raise
+    finally:
+        farm.close()
+    for test_mode, (success, run_duration_m) in zip(test_modes, results):
+        yield test_mode, success, run_duration_m
 
 def main():
     """Hlavní funkce pro spuštění testovacího scénáře."""
+    _init_logging() # Jen při prvním volání
     logging.info("==============================================")
     logging.info("   Starting Automated Battery Cycle Tester    ")
     logging.info("==============================================")
@@ -342,6 +540,9 @@ def main():
         logging.critical("Failed to load configuration. Exiting.")
         sys.exit(1)
 
+    gen, plan = config['general'], config['test_plan'] # Sekce používané opakovaně - indexujeme jednou
+    _apply_scheduling(gen)
+
     # Inicializace ovladačů HW
     logging.info("Initializing hardware controllers...")
     relay_ctl = None
@@ -349,26 +550,30 @@ def main():
     temp_ctl = None
     init_ok = True
     try:
+        from hardware_ctl.relay_controller import RelayController
+        from hardware_ctl.temp_controller import TempController
+        from test_logic import test_steps
+        relay_cfg = config['relay']
         relay_ctl = RelayController(
-            ip_address=config['relay']['ip_address'],
-            usb_relay_pins=config['relay'].get('usb_power_relay_pins', []), # Čteme seznam
-            charger_relay_pins=config['relay'].get('charger_enable_relay_pins'), # Nepovinný seznam
-            beeper_pins=config['relay'].get('beeper_pins') # Nepovinný seznam
+            ip_address=relay_cfg['ip_address'],
+            usb_relay_pins=relay_cfg['usb_power_relay_pins'], # Čteme seznam
+            charger_relay_pins=relay_cfg['charger_enable_relay_pins'], # Nepovinný seznam
+            beeper_pins=relay_cfg['beeper_pins'] # Nepovinný seznam
         )
         # -------------------------------------------------------------
 
-        notifications_config = config.get('notifications', {})
+        notifications_config = config['notifications']
         temp_ctl = TempController(config['temperature_chamber'], relay_ctl, notifications_config)
 
         # ... (inicializace dut_ctl - stejná) ...
-        is_simulation = config['general'].get('simulate_dut', False)
+        is_simulation = gen['simulate_dut']
         if is_simulation:
             from simulation.dummy_dut_controller import DummyDutController
             dut_ctl = DummyDutController(config['dut_commands'])
             logging.warning("<<<<< RUNNING IN DUT SIMULATION MODE >>>>>")
         else:
             from hardware_ctl.dut_controller import DutController
-            dut_ctl = DutController(config['general']['dut_serial_port'],
+            dut_ctl = DutController(gen['dut_serial_port'],
                                     config['dut_commands'],
                                     verbose=False)
             logging.info("--- Running with REAL DUT controller ---")
@@ -382,41 +587,45 @@ def main():
 
     if not init_ok:
         logging.critical("Exiting due to controller initialization failure.")
-        if relay_ctl: relay_ctl.close()
-        if temp_ctl: temp_ctl.close()
+        _close_controllers(relay_ctl, dut_ctl, temp_ctl) # Zavře i DUT, pokud stihl otevřít sériový port
         sys.exit(1)
 
     # Kontrola periferií
     if not check_peripherals(config, relay_ctl, dut_ctl, temp_ctl):
         logging.critical("Exiting due to failed peripheral checks.")
-        if relay_ctl: relay_ctl.close()
-        if dut_ctl: dut_ctl.close()
-        if temp_ctl: temp_ctl.close()
+        _close_controllers(relay_ctl, dut_ctl, temp_ctl)
         sys.exit(1)
 
     # Vytvoření hlavní výstupní složky
-    base_output_dir = Path(config['general']['output_directory'])
+    base_output_dir = Path(gen['output_directory'])
     try:
         base_output_dir.mkdir(parents=True, exist_ok=True)
         logging.info(f"Test results will be saved in: {base_output_dir.resolve()}")
     except OSError as e:
          logging.critical(f"Failed to create output directory {base_output_dir}: {e}. Exiting.")
-         if relay_ctl: relay_ctl.close();
-         if dut_ctl: dut_ctl.close();
-         if temp_ctl: temp_ctl.close();
+         _close_controllers(relay_ctl, dut_ctl, temp_ctl)
          sys.exit(1)
 
 
     # Načtení plánu
-    temperatures = config['test_plan'].get('temperatures_celsius', [25])
-    test_modes_to_run = config['test_plan'].get('test_modes', ['linear'])
-    cycles_per_temp = config['test_plan'].get('cycles_per_temperature', 1)
+    temperatures = plan['temperatures_celsius']
+    test_modes_to_run = plan['test_modes']
+    cycles_per_temp = plan['cycles_per_temperature']
+    # Hodnoty neměnné v průběhu testu - čteme z configu jen jednou, ne v každém běhu
+    fail_fast = gen['fail_fast']
+    log_interval = gen['log_interval_seconds']
+    relax_s = plan['relaxation_time_seconds']
+    # Souběžné módy jen v simulaci - reálné DUT je jedno a sdílené
+    parallel_modes = is_simulation and gen['parallel_modes'] and len(test_modes_to_run) > 1
+    if gen['parallel_modes'] and not is_simulation:
+        logging.warning("'parallel_modes' is only supported with simulate_dut = true. Running modes sequentially.")
+    run_modes = _run_modes_parallel if parallel_modes else _run_modes_serial
     total_runs = len(temperatures) * cycles_per_temp * len(test_modes_to_run)
     completed_runs = 0
 
     logging.info(f"Test plan: Temperatures={temperatures}, Modes={test_modes_to_run}, CyclesPerTemp={cycles_per_temp}. Total runs: {total_runs}")
     logging.info(f"DUT Simulation Mode: {'ENABLED' if is_simulation else 'DISABLED'}")
-    logging.info(f"Temperature Control: {'MANUAL' if not config['temperature_chamber'].get('enabled', False) else 'AUTOMATIC'}")
+    logging.info(f"Temperature Control: {'MANUAL' if not config['temperature_chamber']['enabled'] else 'AUTOMATIC'}")
 
     start_time = time.time()
     test_aborted = False
@@ -433,24 +642,16 @@ def main():
             for cycle_num in range(cycles_per_temp):
                 logging.info(f"--- Starting Overall Cycle {cycle_num + 1}/{cycles_per_temp} for {temp_c}°C ---")
 
-                for test_mode in test_modes_to_run:
-                    run_start_time = time.time()
-                    logging.info(f"  -- Running Test Mode: '{test_mode}' --")
-
-                    # Volání funkce pro provedení specifického módu
-                    # Předáme všechny ovladače a konfiguraci
-                    success = run_test_cycle(config, temp_c, cycle_num, test_mode,
-                                             temp_ctl, relay_ctl, dut_ctl)
-
-                    run_end_time = time.time()
-                    run_duration_m = (run_end_time - run_start_time) / 60
-
+                # Volání funkce pro provedení specifického módu (sériově, nebo v simulaci volitelně souběžně)
+                for test_mode, success, run_duration_m in run_modes(config, temp_c, cycle_num, test_modes_to_run,
+                                                                    temp_ctl, relay_ctl, dut_ctl,
+                                                                    base_output_dir, log_interval, relax_s):
                     if success:
                         completed_runs += 1
                         logging.info(f"  -- Test Mode '{test_mode}' finished successfully in {run_duration_m:.1f} minutes. --")
                     else:
                         logging.error(f"  -- Test Mode '{test_mode}' failed after {run_duration_m:.1f} minutes. --")
-                        if config.get('general', {}).get('fail_fast', False):
+                        if fail_fast:
                              logging.warning("Fail fast enabled. Aborting entire test plan.")
                              test_aborted = True
                              break # Ukončí smyčku módů
@@ -480,15 +681,8 @@ def main():
             try:
                 logging.info("Ensuring all relays are OFF...")
                 relay_ctl.turn_all_relays_off() # <-- Explicitní vypnutí všech
-                relay_ctl.close()
             except Exception as e_relay: logging.error(f"Error during relay cleanup: {e_relay}")
-        # ... (cleanup dut_ctl a temp_ctl) ...
-        if dut_ctl:
-            try: dut_ctl.close()
-            except Exception as e_dut: logging.error(f"Error during DUT controller cleanup: {e_dut}")
-        if temp_ctl:
-            try: temp_ctl.close()
-            except Exception as e_temp: logging.error(f"Error during Temperature controller cleanup: {e_temp}")
+        _close_controllers(relay_ctl, dut_ctl, temp_ctl)
         
         # --- Závěrečné logování ---
         logging.info("==================== TEST SUMMARY ====================")  
@@ -504,7 +698,4 @@ def main():
 
 
 if __name__ == "__main__":
-    # Zajištění, že základní logging funguje i před načtením configu
-    if not logger.hasHandlers():
-         logger.addHandler(logging.StreamHandler(sys.stdout)) # Minimální handler pro chyby v úvodu
-    main()
\ No newline at end of file
+    main() # Logging se nastaví v main(), zbylé záznamy zapíše _stop_logging() přes atexit
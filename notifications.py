@@ -1,17 +1,25 @@
 # notifications.py
 
+import atexit
 import logging
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Optional
 # from urllib.parse import quote_plus # Už nepotřebujeme pro message
 
 logger = logging.getLogger(__name__)
 
+# Jedna Session pro všechny zprávy - TCP/TLS spojení na Slack se drží (keep-alive) a znovu použije
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1,
+                                       max_retries=Retry(total=2, backoff_factor=0.2)))
+atexit.register(_session.close)
+
 def send_slack_message(webhook_url: Optional[str], message: str, fallback_text: str = "Notification from Battery Tester") -> bool:
     """
     Odešle zprávu na Slack pomocí Incoming Webhook URL.
-    Používá metodu odeslání JSONu jako 'payload' parametr.
+    Payload se posílá přímo jako JSON tělo požadavku (application/json).
 
     Args:
         webhook_url: URL adresa Slack Webhooku.
@@ -50,22 +58,16 @@ def send_slack_message(webhook_url: Optional[str], message: str, fallback_text:
     # ------------------------------------
 
     try:
-        # --- ZMĚNA: Odeslání jako 'payload' parametr ---
-        # Převod slovníku na JSON řetězec
-        payload_json_string = json.dumps(slack_data)
-
-        # Data pro POST požadavek ve formátu application/x-www-form-urlencoded
-        post_data = {'payload': payload_json_string}
-
-        logger.info(f"Sending Slack notification via webhook (using payload parameter)...")
-        logger.debug(f"Slack Webhook URL: {webhook_url}")
-        logger.debug(f"Slack Payload (JSON String): {payload_json_string}")
+        # Webhook přijímá JSON tělo přímo - bez json.dumps + form-encode ('payload' parametru)
+        logger.info(f"Sending Slack notification via webhook...")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Slack Webhook URL: %s", webhook_url)
+            logger.debug("Slack Payload: %r", slack_data)
 
         timeout_seconds = 15
-        response = requests.post(
+        response = _session.post(
             webhook_url,
-            data=post_data, # <-- Posíláme slovník, requests ho zakóduje jako form data
-            # headers={'Content-Type': 'application/x-www-form-urlencoded'} # Requests by mělo nastavit samo pro data=dict
+            json=slack_data, # requests serializuje a nastaví Content-Type: application/json
             timeout=timeout_seconds
         )
         # -------------------------------------------
@@ -96,10 +98,10 @@ def send_slack_message(webhook_url: Optional[str], message: str, fallback_text:
 
 # ... (if __name__ == '__main__' blok zůstává pro testování) ...
 if __name__ == '__main__':
-    print("Testing Slack notification module (sends as payload parameter)...")
+    print("Testing Slack notification module (sends JSON body)...")
     test_webhook_url = "YOUR_SLACK_WEBHOOK_URL" # <-- NAHRAĎ SKUTEČNOU URL
-    test_msg = "Test z Pythonu :wave: (posláno jako payload parametr).\n*Formátování* by mělo _fungovat_."
-    fallback = "Test from Python (payload)"
+    test_msg = "Test z Pythonu :wave: (posláno jako JSON).\n*Formátování* by mělo _fungovat_."
+    fallback = "Test from Python (JSON)"
 
     if "YOUR_SLACK_WEBHOOK_URL" == test_webhook_url or not test_webhook_url:
         print("\nPlease replace YOUR_SLACK_WEBHOOK_URL with your actual Slack Webhook URL.")
@@ -1,48 +1,86 @@
 # simulation/dummy_dut_controller.py
 
+import atexit
 import time
-import random
+import math
 import threading
 import logging
 import numpy as np
 from typing import Optional, Dict, Any
 
-class DummyDutController:
-    """
-    Simuluje chování DUT pro testování bez reálného hardware.
-    Implementuje všechny metody očekávané reálným DutControllerem.
-    Reaguje na nastavení režimů a simuluje změny napětí, proudu, teplot.
+try:
+    from numba import njit # Volitelné - přeloží _tick do nativního kódu
+except ImportError: # Bez numby běží _tick jako obyčejná NumPy funkce
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+MODE_IDLE, MODE_CHARGING, MODE_DISCHARGING = 0, 1, 2
+_MODE_NAMES = ("IDLE", "CHARGING", "DISCHARGING")
+_IBA_STATUS = ("0x18", "0x0C", "0x0C") # Status podle mode_id
+_BUCK_STATUS = ("0x00", "0x0C", "0x00")
+
+@njit(cache=True, fastmath=True)
+def _tick(v_now, ntc_now, die_now, can_charge, is_forced_discharging, params, active_f, idle_f):
     """
+    Jeden krok simulace pro všechny baterie farmy najednou - vstupy jsou 1-D pole (jeden prvek = jedno DUT),
+    větvení je nahrazeno np.where. Žádné Python objekty (kompatibilní s numba @njit).
 
-    def __init__(self, dut_cmds: dict, initial_voltage: float = 3.7, initial_mode: str = "IDLE"):
-        """
-        Inicializuje simulátor.
+    params: konstanty jednoho kroku předpočítané v DummyDutFarm._step_params()
 
+    Returns:
+        (mode_id, delta_v, current_ma, ntc_temp_change, die_temp_change) - pole
+    """
+    (max_v, min_v, cv_phase_threshold, inv_cv_span, chg_cc_ma, dis_ma, idle_ma, full_thr_ma,
+     dv_charge, dv_discharge, heat_chg, heat_dis, ambient, cool) = params
+
+    # --- Určení efektivního režimu (vybíjení běží jen pokud bylo explicitně vynuceno) ---
+    charging = can_charge & (v_now < max_v)
+    discharging = ~charging & is_forced_discharging & (v_now > min_v)
+    heat_factor = np.maximum(v_now - min_v, 0.0)
+
+    # --- Nabíjení: CC fáze, v CV fázi nelineární pokles proudu ---
+    in_cv = v_now >= cv_phase_threshold
+    charge_completion = np.maximum(max_v - v_now, 0.0) * inv_cv_span
+    chg_current = np.where(in_cv, full_thr_ma + (chg_cc_ma - full_thr_ma) * charge_completion ** 1.5, chg_cc_ma) * active_f
+    charge_done = charging & in_cv & (chg_current <= full_thr_ma) # Ukončení nabíjení (nízký proud)
+
+    # --- Vybíjení ---
+    dis_done = discharging & (v_now + dv_discharge <= min_v) # Ukončení vybíjení (minimální napětí)
+
+    mode_id = np.where(charging & ~charge_done, MODE_CHARGING,
+                       np.where(discharging & ~dis_done, MODE_DISCHARGING, MODE_IDLE))
+    current = np.where(charge_done | dis_done, idle_ma * idle_f,
+                       np.where(charging, chg_current, np.where(discharging, dis_ma * active_f, idle_ma)))
+    delta_v = np.where(charging, dv_charge,
+                       np.where(dis_done, min_v - v_now, np.where(discharging, dv_discharge, 0.0))) # Při ukončení přesně na limit
+
+    # Ohřev + chladnutí (chladnutí vždy probíhá, i při nabíjení/vybíjení)
+    heat = np.where(charging, heat_chg, np.where(discharging, heat_dis, 0.0)) * heat_factor
+    ntc_change = heat + (ambient - ntc_now) * cool
+    die_change = heat * np.where(charging, 1.5, 1.2) + (ambient + 5.0 - die_now) * cool
+    return mode_id, delta_v, current, ntc_change, die_change
+
+class DummyDutFarm:
+    """
+    Simuluje n baterií najednou. Stav je uložen po sloupcích (jedno NumPy pole na veličinu, prvek = DUT),
+    jedno vlákno posouvá všechny baterie jedním vektorovým krokem. Jednotlivá DUT zpřístupňuje DummyDutController.
+    """
+    NOISE_BLOCK_STEPS = 256 # Počet kroků simulace, pro které se šum losuje najednou
+    # Řádky bloku šumu: faktor proudu nabíjení/vybíjení, faktor klidového proudu, šum NTC, šum die, šum VSYS
+    _NOISE_OFFSET = np.array([[1.0], [1.0], [0.0], [0.0], [0.0]])
+    _NOISE_AMPLITUDE = np.array([[0.02], [0.2], [0.01], [0.02], [0.05]])
+    GETTER_NOISE_SIZE = 8192 # Délka kruhového bufferu šumu pro gettery (mocnina 2 - index se maskuje)
+    _GETTER_NOISE_AMPLITUDE = np.array([[0.002], [1.0], [0.05], [0.1]]) # Napětí, proud, NTC, die
+
+    def __init__(self, n_duts: int = 1, initial_voltage: float = 3.7, initial_mode: str = "IDLE"):
+        """
         Args:
-            dut_cmds: Slovník příkazů (použito jen pro referenci).
-            initial_voltage: Počáteční napětí baterie.
+            n_duts: Počet simulovaných DUT.
+            initial_voltage: Počáteční napětí baterií.
             initial_mode: Počáteční režim (IDLE, CHARGING, DISCHARGING).
         """
-        logging.info("Initializing Dummy DUT Controller...")
-        self.cmds = dut_cmds # Nepoužíváme, ale zachováváme pro kompatibilitu rozhraní
-
-        # --- Simulovaný stav ---
-        self._voltage: float = float(initial_voltage)
-        self._current: float = 0.0
-        self._mode: str = initial_mode.upper()
-        self._is_charging_sw_enabled: bool = False
-        self._is_charging_hw_enabled: bool = False
-        self._is_usb_connected: bool = False
-        self._is_forced_discharging: bool = self._mode == "DISCHARGING" # Sledujeme explicitní příkaz
-
-        # Ostatní simulované hodnoty
-        self._dut_time_ms: int = random.randint(100000, 200000)
-        self.ambient_temp: float = 25.0
-        self._ntc_temp: float = self.ambient_temp + random.uniform(-0.5, 0.5)
-        self._vsys: float = 0.0
-        self._die_temp: float = self.ambient_temp + 5.0 + random.uniform(-1.0, 1.0)
-        self._iba_meas_status: str = "0x18"
-        self._buck_status: str = "0x00"
+        self.n_duts = n_duts
+        self._rng = np.random.default_rng()
 
         # --- Parametry simulace ---
         # Načtení z configu by bylo lepší, zde pevné hodnoty
@@ -56,232 +94,351 @@ class DummyDutController:
         self.idle_current_ma: float = -1.5       # Samovybíjení mA
         self.full_charge_current_threshold_ma: float = 50.0 # Ukončení CV fáze
         # Teplotní parametry
+        self.ambient_temp: float = 25.0
         self.charge_heating_factor: float = 0.02 # °C/s na Volt nad min_voltage
         self.discharge_heating_factor: float = 0.01
         self.cooling_rate_factor: float = 0.005 # Faktor chladnutí (1/časová konstanta)
         self.max_ntc_temp: float = 50.0         # Bezpečnostní limity teplot
         self.max_die_temp: float = 60.0
 
+        # --- Simulovaný stav (SoA - prvek pole = jedno DUT) ---
+        mode_id = _MODE_NAMES.index(initial_mode.upper())
+        self.voltage = np.full(n_duts, float(initial_voltage))
+        self.current = np.zeros(n_duts)
+        self.mode_id = np.full(n_duts, mode_id, dtype=np.int64)
+        self.charging_sw_enabled = np.zeros(n_duts, dtype=np.bool_)
+        self.charging_hw_enabled = np.zeros(n_duts, dtype=np.bool_)
+        self.usb_connected = np.zeros(n_duts, dtype=np.bool_)
+        self.forced_discharging = self.mode_id == MODE_DISCHARGING # Sledujeme explicitní příkaz
+        self.dut_time_ms = self._rng.integers(100000, 200000, size=n_duts, endpoint=True)
+        self.ntc_temp = self.ambient_temp + self._rng.uniform(-0.5, 0.5, n_duts)
+        self.die_temp = self.ambient_temp + 5.0 + self._rng.uniform(-1.0, 1.0, n_duts)
+        self.vsys = np.zeros(n_duts)
+
         # --- Interní řízení ---
         self._stop_event = threading.Event()
-        self._simulation_thread: Optional[threading.Thread] = None # Inicializace na None
-        self._lock = threading.Lock() # Zámek pro bezpečný přístup k sdíleným stavům
-        self._start_simulation_thread() # Spustíme vlákno
-
-        logging.info(f"Dummy DUT Controller Initialized. Initial state: V={self._voltage:.3f}V, Mode={self._mode}")
+        self._simulation_thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock() # Zámek pro zápis stavu (krok simulace i ovládací metody DUT)
+        self._fill_getter_noise()
+        self.publish_snapshots()
+        self._start_simulation_thread()
+        atexit.register(self.close) # Pojistka, pokud vlastník zapomene zavolat close() (běží před GC, v hlavním vlákně)
 
     def _start_simulation_thread(self):
         """Spustí simulační vlákno, pokud ještě neběží."""
         if self._simulation_thread is None or not self._simulation_thread.is_alive():
             self._stop_event.clear()
-            self._simulation_thread = threading.Thread(target=self._simulate_battery, name="DummyDUTSimThread", daemon=True)
+            self._simulation_thread = threading.Thread(target=self._simulate_batteries, name="DummyDUTSimThread", daemon=True)
             self._simulation_thread.start()
-            logging.info("Dummy DUT simulation thread started.")
+            logging.info(f"Dummy DUT simulation thread started ({self.n_duts} DUT).")
         else:
             logging.debug("Dummy DUT simulation thread already running.")
 
-    def _simulate_battery(self):
-        """Hlavní smyčka simulace běžící ve vlákně."""
-        logging.debug(f"Dummy DUT simulation loop starting (step={self.simulation_step_s}s)...")
+    def _precompute_block(self, n_steps: int) -> np.ndarray:
+        """Vylosuje šum pro n_steps kroků všech DUT jedním vektorovým voláním, tvar (n_steps, 5, n_duts)."""
+        u = self._rng.uniform(-1.0, 1.0, size=(n_steps, len(self._NOISE_OFFSET), self.n_duts))
+        return self._NOISE_OFFSET + self._NOISE_AMPLITUDE * u
+
+    def _fill_getter_noise(self):
+        """Předvygeneruje šum měření pro gettery (jeden vektorový los místo random.uniform v každém volání)."""
+        u = self._rng.uniform(-1.0, 1.0, size=(len(self._GETTER_NOISE_AMPLITUDE), self.GETTER_NOISE_SIZE))
+        # Výměna referencí je atomická - gettery nikdy nevidí napůl naplněný buffer
+        self.noise_v, self.noise_i, self.noise_ntc, self.noise_die = (self._GETTER_NOISE_AMPLITUDE * u).tolist()
+
+    def publish_snapshots(self):
+        """
+        Zveřejní aktuální stav každého DUT jako neměnnou n-tici (volat se zámkem lock, nebo před startem vlákna).
+        Přiřazení reference je atomické - čtenáři vždy vidí konzistentní stav jednoho kroku bez zamykání.
+        """
+        modes = self.mode_id.tolist()
+        self.snapshots = list(zip(self.dut_time_ms.tolist(), self.voltage.tolist(), self.current.tolist(),
+                                  self.ntc_temp.tolist(), self.vsys.tolist(), self.die_temp.tolist(),
+                                  [_IBA_STATUS[m] for m in modes], [_BUCK_STATUS[m] for m in modes],
+                                  [_MODE_NAMES[m] for m in modes]))
+
+    def _step_params(self) -> tuple:
+        """Konstanty jednoho kroku pro _tick - násobení krokem a odvozené prahy se spočítají jednou, ne v každém kroku."""
         step_s = self.simulation_step_s
+        cv_phase_threshold = self.max_voltage - 0.1
+        return (float(self.max_voltage), float(self.min_voltage), float(cv_phase_threshold),
+                1.0 / max(self.max_voltage - cv_phase_threshold, 1e-6),
+                float(self.charging_current_ma_cc), float(self.discharging_current_ma), float(self.idle_current_ma),
+                float(self.full_charge_current_threshold_ma),
+                self.charge_rate_v_per_s * step_s, -self.discharge_rate_v_per_s * step_s,
+                self.charge_heating_factor * step_s, self.discharge_heating_factor * step_s, float(self.ambient_temp),
+                # Chladnutí k okolní teplotě jako přesný exponenciální pokles za jeden krok (místo Eulerova kroku)
+                1.0 - math.exp(-self.cooling_rate_factor * step_s))
+
+    def _simulate_batteries(self):
+        """Hlavní smyčka simulace běžící ve vlákně - jeden vektorový krok pro všechna DUT."""
+        logging.debug("Dummy DUT simulation loop starting (step=%ss, %d DUT)...", self.simulation_step_s, self.n_duts)
+        step_s = self.simulation_step_s
+        noise_block = self._precompute_block(self.NOISE_BLOCK_STEPS)
+        noise_idx = 0
+        params = self._step_params()
+        step_ms = int(step_s * 1000)
+        step_ns = int(step_s * 1e9) # Časování v celých ns - bez float mezivýsledků v každém kroku
+        monotonic_ns = time.monotonic_ns
+        lo_v, hi_v = self.min_voltage - 0.05, self.max_voltage + 0.05
 
         while not self._stop_event.is_set():
-            loop_start_time = time.monotonic()
+            loop_start_ns = monotonic_ns()
+            if noise_idx == len(noise_block):
+                noise_block = self._precompute_block(self.NOISE_BLOCK_STEPS)
+                noise_idx = 0
+                self._fill_getter_noise() # Obnova šumu getterů mimo čtecí cestu (RNG používá jen toto vlákno)
+            active_f, idle_f, ntc_noise, die_noise, vsys_noise = noise_block[noise_idx]
+            noise_idx += 1
 
             # --- Získání aktuálních řídících stavů pod zámkem ---
-            with self._lock:
-                v_now = self._voltage
-                mode_now = self._mode
-                ntc_now = self._ntc_temp
-                die_now = self._die_temp
-                can_charge = self._is_usb_connected and self._is_charging_sw_enabled and self._is_charging_hw_enabled
-                is_forced_discharging = self._is_forced_discharging # Použijeme nový flag
-
-            # --- Určení efektivního režimu ---
-            effective_mode = "IDLE" # Výchozí
-            if can_charge and v_now < self.max_voltage:
-                 effective_mode = "CHARGING"
-            elif is_forced_discharging and v_now > self.min_voltage:
-                 # Vybíjení běží jen pokud bylo explicitně vynuceno
-                 effective_mode = "DISCHARGING"
-
-            # --- Výpočet změn ---
-            delta_v = 0.0
-            current_calc = self.idle_current_ma
-            ntc_temp_change = 0.0
-            die_temp_change = 0.0
-            final_mode_this_step = effective_mode # Může se změnit při ukončení chg/dischg
-
-            if effective_mode == "CHARGING":
-                cv_phase_threshold = self.max_voltage - 0.1
-                if v_now >= cv_phase_threshold: # CV Fáze
-                     # Nelineární pokles proudu v CV fázi
-                     charge_completion = max(0, (self.max_voltage - v_now)) / max(1e-6, (self.max_voltage - cv_phase_threshold))
-                     current_calc = self.full_charge_current_threshold_ma + \
-                                      (self.charging_current_ma_cc - self.full_charge_current_threshold_ma) * charge_completion**1.5
-                else: # CC Fáze
-                    current_calc = self.charging_current_ma_cc
-                current_calc *= random.uniform(0.98, 1.02)
-                delta_v = self.charge_rate_v_per_s * step_s
-
-                # Ohřev
-                heat_factor = max(0, v_now - self.min_voltage)
-                ntc_temp_change += self.charge_heating_factor * heat_factor * step_s
-                die_temp_change += self.charge_heating_factor * heat_factor * 1.5 * step_s
-
-                # Ukončení nabíjení
-                if current_calc <= self.full_charge_current_threshold_ma and v_now >= cv_phase_threshold:
-                    final_mode_this_step = "IDLE"
-                    current_calc = self.idle_current_ma * random.uniform(0.8, 1.2)
-                    logging.debug("Dummy DUT: Charge complete (low current).")
-
-            elif effective_mode == "DISCHARGING":
-                current_calc = self.discharging_current_ma * random.uniform(0.98, 1.02)
-                delta_v = -self.discharge_rate_v_per_s * step_s
-
-                # Ohřev
-                heat_factor = max(0, v_now - self.min_voltage)
-                ntc_temp_change += self.discharge_heating_factor * heat_factor * step_s
-                die_temp_change += self.discharge_heating_factor * heat_factor * 1.2 * step_s
-
-                # Ukončení vybíjení
-                if v_now + delta_v <= self.min_voltage:
-                    final_mode_this_step = "IDLE"
-                    current_calc = self.idle_current_ma * random.uniform(0.8, 1.2)
-                    delta_v = self.min_voltage - v_now # Přesně na limit
-                    logging.debug("Dummy DUT: Discharge complete (min voltage).")
-
-            # Chladnutí (vždy probíhá, i při nabíjení/vybíjení)
-            ntc_temp_change += (self.ambient_temp - ntc_now) * self.cooling_rate_factor * step_s
-            die_temp_change += (self.ambient_temp + 5 - die_now) * self.cooling_rate_factor * step_s
+            with self.lock:
+                v_now = self.voltage.copy()
+                ntc_now = self.ntc_temp.copy()
+                die_now = self.die_temp.copy()
+                can_charge = self.usb_connected & self.charging_sw_enabled & self.charging_hw_enabled
+                is_forced_discharging = self.forced_discharging.copy()
+
+            # --- Výpočet kroku (čistá aritmetika nad poli - viz _tick) ---
+            mode_id, delta_v, current_calc, ntc_temp_change, die_temp_change = _tick(
+                v_now, ntc_now, die_now, can_charge, is_forced_discharging, params, active_f, idle_f)
 
             # --- Aktualizace stavů pod zámkem ---
-            with self._lock:
-                # Aktualizace času DUT
-                self._dut_time_ms += int(step_s * 1000)
-
-                # Nastavení režimu
-                if self._mode != final_mode_this_step:
-                    logging.debug(f"Dummy DUT Mode changed: {self._mode} -> {final_mode_this_step} (V={self._voltage:.3f})")
-                    self._mode = final_mode_this_step
-                    # Pokud přejdeme na IDLE z DISCHARGING, vynulujeme force flag
-                    if self._mode == "IDLE" and is_forced_discharging:
-                         self._is_forced_discharging = False
-
-                # Aktualizace napětí s omezením
-                self._voltage += delta_v
-                self._voltage = max(self.min_voltage - 0.05, min(self.max_voltage + 0.05, self._voltage))
-                self._current = current_calc
-
-                # Aktualizace teplot s omezením
-                self._ntc_temp += ntc_temp_change + random.uniform(-0.01, 0.01) * step_s
-                self._die_temp += die_temp_change + random.uniform(-0.02, 0.02) * step_s
-                self._ntc_temp = max(0, min(self.max_ntc_temp, self._ntc_temp))
-                self._die_temp = max(5, min(self.max_die_temp, self._die_temp))
-
-                # Aktualizace statusů
-                self._vsys = 5.0 + random.uniform(-0.05, 0.05) if self._is_usb_connected else 0.0
-                if self._mode == "CHARGING": self._iba_meas_status="0x0C"; self._buck_status="0x0C"
-                elif self._mode == "DISCHARGING": self._iba_meas_status="0x0C"; self._buck_status="0x00"
-                else: self._iba_meas_status="0x18"; self._buck_status="0x00"
+            with self.lock:
+                self.dut_time_ms += step_ms # Aktualizace času DUT
+
+                # Nastavení režimu; při přechodu na IDLE z vynuceného vybíjení vynulujeme force flag
+                changed = mode_id != self.mode_id
+                if changed.any():
+                    for k in np.flatnonzero(changed):
+                        logging.debug("Dummy DUT #%d Mode changed: %s -> %s (V=%.3f)", k, _MODE_NAMES[self.mode_id[k]],
+                                      _MODE_NAMES[mode_id[k]], self.voltage[k])
+                    self.forced_discharging &= ~(changed & (mode_id == MODE_IDLE) & is_forced_discharging)
+                    self.mode_id[:] = mode_id
+
+                # Aktualizace napětí a teplot s omezením
+                np.clip(self.voltage + delta_v, lo_v, hi_v, out=self.voltage)
+                self.current[:] = current_calc
+                np.clip(self.ntc_temp + ntc_temp_change + ntc_noise * step_s, 0, self.max_ntc_temp, out=self.ntc_temp)
+                np.clip(self.die_temp + die_temp_change + die_noise * step_s, 5, self.max_die_temp, out=self.die_temp)
+                self.vsys[:] = np.where(self.usb_connected, 5.0 + vsys_noise, 0.0)
+                self.publish_snapshots()
 
             # --- Čekání ---
-            loop_end_time = time.monotonic()
-            sleep_duration = max(0, step_s - (loop_end_time - loop_start_time))
-            self._stop_event.wait(sleep_duration) # Přerušitelné čekání
+            remaining_ns = step_ns - (monotonic_ns() - loop_start_ns)
+            self._stop_event.wait(max(0, remaining_ns) * 1e-9) # Přerušitelné čekání
 
         logging.debug("Dummy DUT simulation loop finished.")
 
-    # --- Metody pro získání dat (bezpečný přístup pod zámkem) ---
+    def advance(self, dt_s: float):
+        """
+        Posune všechna DUT o dt_s sekund najednou v uzavřeném tvaru (bez krokování) - pro rychlé běhy bez reálného času.
+        V rámci fáze (nabíjení/vybíjení/klid) je napětí lineární v čase a teplota je zpožděním 1. řádu
+        za lineárně se měnící rovnovážnou teplotou; na hranici fáze se výpočet navazuje zbytkem intervalu.
+        """
+        if dt_s <= 0: return
+        k = self.cooling_rate_factor
+        max_v, min_v = self.max_voltage, self.min_voltage
+        with self.lock:
+            for n in range(self.n_duts):
+                v, ntc, die = float(self.voltage[n]), float(self.ntc_temp[n]), float(self.die_temp[n])
+                can_charge = self.usb_connected[n] and self.charging_sw_enabled[n] and self.charging_hw_enabled[n]
+                remaining = dt_s
+                while True:
+                    # --- Fáze a doba do jejího konce ---
+                    if can_charge and v < max_v:
+                        mode, rate, heat, die_mult = MODE_CHARGING, self.charge_rate_v_per_s, self.charge_heating_factor, 1.5
+                        t_end = (max_v - v) / rate
+                    elif self.forced_discharging[n] and v > min_v:
+                        mode, rate, heat, die_mult = MODE_DISCHARGING, -self.discharge_rate_v_per_s, self.discharge_heating_factor, 1.2
+                        t_end = (v - min_v) / -rate
+                    else:
+                        mode, rate, heat, die_mult, t_end = MODE_IDLE, 0.0, 0.0, 1.0, math.inf
+                    t = min(remaining, t_end)
+
+                    # --- Teploty: T' = k*(g(τ) - T), g lineární -> T(t) = g(t) - s/k + (T0 - g(0) + s/k)*e^(-kt) ---
+                    decay = math.exp(-k * t)
+                    for_ntc = heat / k
+                    for_die = heat * die_mult / k
+                    g0_ntc, s_ntc = self.ambient_temp + for_ntc * (v - min_v), for_ntc * rate
+                    g0_die, s_die = self.ambient_temp + 5.0 + for_die * (v - min_v), for_die * rate
+                    ntc = g0_ntc + s_ntc * t - s_ntc / k + (ntc - g0_ntc + s_ntc / k) * decay
+                    die = g0_die + s_die * t - s_die / k + (die - g0_die + s_die / k) * decay
+
+                    v = (max_v if mode == MODE_CHARGING else min_v) if t == t_end else v + rate * t
+                    remaining -= t
+                    if t < t_end: break
+                    if mode == MODE_DISCHARGING: self.forced_discharging[n] = False # Vybito - jako v _tick
+
+                # --- Proud a režim na konci intervalu ---
+                if mode == MODE_CHARGING:
+                    completion = max(max_v - v, 0.0) / 0.1
+                    cv = v >= max_v - 0.1
+                    current = (self.full_charge_current_threshold_ma + (self.charging_current_ma_cc - self.full_charge_current_threshold_ma)
+                               * completion ** 1.5) if cv else self.charging_current_ma_cc
+                else:
+                    current = self.discharging_current_ma if mode == MODE_DISCHARGING else self.idle_current_ma
+                self.voltage[n] = v
+                self.current[n] = current
+                self.mode_id[n] = mode
+                self.ntc_temp[n] = min(max(ntc, 0.0), self.max_ntc_temp)
+                self.die_temp[n] = min(max(die, 5.0), self.max_die_temp)
+            self.dut_time_ms += int(dt_s * 1000)
+            self.vsys[:] = np.where(self.usb_connected, 5.0, 0.0)
+            self.publish_snapshots()
+
+    def close(self):
+        """Zastaví simulační vlákno (bezpečné volat opakovaně)."""
+        atexit.unregister(self.close)
+        if self._simulation_thread and self._simulation_thread.is_alive():
+            self._stop_event.set()
+            self._simulation_thread.join(timeout=max(1.0, self.simulation_step_s * 2))
+            if self._simulation_thread.is_alive():
+                logging.warning("Dummy DUT simulation thread did not stop gracefully.")
+            else:
+                 logging.debug("Dummy DUT simulation thread joined successfully.")
+        else:
+             logging.debug("Dummy DUT simulation thread already stopped or not started.")
+        self._simulation_thread = None # Resetovat vlákno
+
+class DummyDutController:
+    """
+    Simuluje chování DUT pro testování bez reálného hardware.
+    Implementuje všechny metody očekávané reálným DutControllerem.
+    Reaguje na nastavení režimů a simuluje změny napětí, proudu, teplot.
+    Stav je jeden řádek DummyDutFarm - bez předané farmy si controller vytvoří vlastní farmu s jedním DUT.
+    """
+    __slots__ = ('cmds', '_owns_farm', '_farm', '_index', '_noise_idx') # Jen pohled na řádek farmy - bez __dict__
+
+    def __init__(self, dut_cmds: dict, initial_voltage: float = 3.7, initial_mode: str = "IDLE",
+                 farm: Optional[DummyDutFarm] = None, index: int = 0):
+        """
+        Inicializuje simulátor.
+
+        Args:
+            dut_cmds: Slovník příkazů (použito jen pro referenci).
+            initial_voltage: Počáteční napětí baterie (jen pro vlastní farmu).
+            initial_mode: Počáteční režim (IDLE, CHARGING, DISCHARGING) (jen pro vlastní farmu).
+            farm: Sdílená farma simulovaných DUT (volitelné).
+            index: Index tohoto DUT ve farmě.
+        """
+        logging.info("Initializing Dummy DUT Controller...")
+        self.cmds = dut_cmds # Nepoužíváme, ale zachováváme pro kompatibilitu rozhraní
+        self._owns_farm = farm is None
+        self._farm = DummyDutFarm(1, initial_voltage, initial_mode) if farm is None else farm
+        self._index = index
+        self._noise_idx = index * 997 # Různá DUT začínají na jiném místě sdíleného bufferu šumu
+
+        logging.info(f"Dummy DUT Controller Initialized. Initial state: V={self._snapshot[1]:.3f}V, Mode={self._snapshot[8]}")
+
+    @property
+    def _snapshot(self) -> tuple:
+        return self._farm.snapshots[self._index]
+
+    def _next_noise_idx(self) -> int:
+        idx = self._noise_idx & (DummyDutFarm.GETTER_NOISE_SIZE - 1)
+        self._noise_idx = idx + 1 # Případný souběh getterů jen zopakuje vzorek šumu - neškodné
+        return idx
+
+    # --- Metody pro získání dat (čtou poslední publikovaný snímek - bez zámku) ---
+    def get_snapshot(self) -> tuple:
+        """
+        Vrátí všechna měření najednou v pořadí sloupců DataLoggeru:
+        (dut_time, vbat, ibat, ntc_temp, vsys, die_temp, iba_meas_status, buck_status, mode).
+        """
+        t, v, i, ntc, vsys, die, iba, buck, mode = self._farm.snapshots[self._index]
+        farm, idx = self._farm, self._next_noise_idx()
+        return (t, v + farm.noise_v[idx], i + farm.noise_i[idx], ntc + farm.noise_ntc[idx],
+                vsys, die + farm.noise_die[idx], iba, buck, mode)
+
+    def get_status(self) -> tuple:
+        """Vrátí (mode, current, voltage) z jednoho snímku - hodnoty k sobě časově patří."""
+        _, v, i, _, _, _, _, _, mode = self._farm.snapshots[self._index]
+        farm, idx = self._farm, self._next_noise_idx()
+        return mode, i + farm.noise_i[idx], v + farm.noise_v[idx]
+
     def get_battery_voltage(self) -> Optional[float]:
-        with self._lock: v = self._voltage
-        return v + random.uniform(-0.002, 0.002)
+        return self._snapshot[1] + self._farm.noise_v[self._next_noise_idx()]
 
     def get_battery_current(self) -> Optional[float]:
-        with self._lock: i = self._current
-        return i + random.uniform(-1.0, 1.0) # Trochu větší šum proudu
+        return self._snapshot[2] + self._farm.noise_i[self._next_noise_idx()] # Trochu větší šum proudu
 
     def get_operation_mode(self) -> Optional[str]:
-        with self._lock: m = self._mode
-        return m
+        return self._snapshot[8]
 
     def get_dut_timestamp(self) -> Optional[int]:
-        with self._lock: t = self._dut_time_ms
-        return t
+        return self._snapshot[0]
 
     def get_ntc_temp(self) -> Optional[float]:
-        with self._lock: temp = self._ntc_temp
-        return temp + random.uniform(-0.05, 0.05)
+        return self._snapshot[3] + self._farm.noise_ntc[self._next_noise_idx()]
 
     def get_vsys(self) -> Optional[float]:
-        with self._lock: vs = self._vsys
-        return vs
+        return self._snapshot[4]
 
     def get_die_temp(self) -> Optional[float]:
-        with self._lock: temp = self._die_temp
-        return temp + random.uniform(-0.1, 0.1)
+        return self._snapshot[5] + self._farm.noise_die[self._next_noise_idx()]
 
     def get_iba_meas_status(self) -> Optional[str]:
-        with self._lock: stat = self._iba_meas_status
-        return stat
+        return self._snapshot[6]
 
     def get_buck_status(self) -> Optional[str]:
-        with self._lock: stat = self._buck_status
-        return stat
+        return self._snapshot[7]
 
-    # --- Ovládací metody (nastavují stavy pod zámkem) ---
+    # --- Ovládací metody (nastavují stavy ve farmě pod zámkem) ---
     def enable_charging_sw(self) -> bool:
         logging.info("Dummy DUT: Received Enable Charging (SW)")
-        with self._lock: self._is_charging_sw_enabled = True
+        with self._farm.lock: self._farm.charging_sw_enabled[self._index] = True
         return True
 
     def disable_charging_sw(self) -> bool:
         logging.info("Dummy DUT: Received Disable Charging (SW)")
-        with self._lock: self._is_charging_sw_enabled = False
+        with self._farm.lock: self._farm.charging_sw_enabled[self._index] = False
         return True
 
     def notify_usb_connected(self, connected: bool):
-        logging.info(f"Dummy DUT: Notified USB Connected = {connected}")
-        with self._lock: self._is_usb_connected = connected
+        if self._farm.usb_connected[self._index] == connected: return # Beze změny - bez logu a zámku
+        logging.info("Dummy DUT: Notified USB Connected = %s", connected)
+        with self._farm.lock: self._farm.usb_connected[self._index] = connected
 
     def notify_charger_hw_enabled(self, enabled: bool):
-         logging.info(f"Dummy DUT: Notified Charger HW Enabled = {enabled}")
-         with self._lock: self._is_charging_hw_enabled = enabled
+         if self._farm.charging_hw_enabled[self._index] == enabled: return
+         logging.info("Dummy DUT: Notified Charger HW Enabled = %s", enabled)
+         with self._farm.lock: self._farm.charging_hw_enabled[self._index] = enabled
 
     def force_discharge_mode(self, discharge: bool):
         """Explicitně zapne/vypne PŘÍZNAK pro vynucené vybíjení."""
-        with self._lock:
+        farm, k = self._farm, self._index
+        with farm.lock:
             if discharge:
-                if self._voltage > self.min_voltage:
+                if farm.voltage[k] > farm.min_voltage:
                     logging.info("Dummy DUT: Forcing DISCHARGING mode flag ON.")
-                    self._is_forced_discharging = True
-                    self._mode = "DISCHARGING" # Okamžitě přepneme i mód pro rychlejší reakci
+                    farm.forced_discharging[k] = True
+                    farm.mode_id[k] = MODE_DISCHARGING # Okamžitě přepneme i mód pro rychlejší reakci
+                    farm.publish_snapshots()
                 else:
                     logging.warning("Dummy DUT: Cannot force DISCHARGING, voltage too low.")
-                    self._is_forced_discharging = False # Zajistíme, že je flag vypnutý
+                    farm.forced_discharging[k] = False # Zajistíme, že je flag vypnutý
             else: # discharge == False
-                if self._is_forced_discharging:
+                if farm.forced_discharging[k]:
                     logging.info("Dummy DUT: Forcing DISCHARGING mode flag OFF.")
-                self._is_forced_discharging = False
+                farm.forced_discharging[k] = False
                 # Mód se sám přepne na IDLE v simulační smyčce, pokud nejsou splněny podmínky pro CHARGING
         return True
 
+    def advance(self, dt_s: float):
+        """Rychlé posunutí simulace o dt_s sekund (posouvá celou farmu, viz DummyDutFarm.advance)."""
+        self._farm.advance(dt_s)
+
     # --- Cleanup ---
     def close(self):
-        """Zastaví simulační vlákno."""
+        """Zastaví simulační vlákno vlastní farmy (sdílenou farmu zavírá její vlastník)."""
         logging.info("Closing Dummy DUT Controller...")
-        if self._simulation_thread and self._simulation_thread.is_alive():
-            self._stop_event.set()
-            self._simulation_thread.join(timeout=max(1.0, self.simulation_step_s * 2))
-            if self._simulation_thread.is_alive():
-                logging.warning("Dummy DUT simulation thread did not stop gracefully.")
-            else:
-                 logging.debug("Dummy DUT simulation thread joined successfully.")
-        else:
-             logging.debug("Dummy DUT simulation thread already stopped or not started.")
-        self._simulation_thread = None # Resetovat vlákno
+        if self._owns_farm:
+            self._farm.close()
         logging.info("Dummy DUT Controller closed.")
 
-    def __del__(self):
-        # Zajistí zastavení vlákna i při smazání objektu
-        self.close()
\ No newline at end of file
+    # Bez __del__ - join vlákna během GC by blokoval náhodné vlákno; úklid je explicitní (close() / with)
+    def __enter__(self) -> 'DummyDutController':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,9 +1,9 @@
-import csv
+import queue
 import time
 import threading
 import logging
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import IO, TYPE_CHECKING
 
 # Podmíněný import pro type hinting
 if TYPE_CHECKING:
@@ -11,8 +11,26 @@ if TYPE_CHECKING:
     from simulation.dummy_dut_controller import DummyDutController
     DutControllerTypes = DutController | DummyDutController
 
+def _f3(x) -> bytes:
+    return b"" if x is None else b"%.3f" % x
+
+def _text(x) -> bytes:
+    """Textové pole z DUT - v uvozovkách jen pokud obsahuje oddělovač (jako csv.writer)."""
+    if x is None: return b""
+    if ',' in x or '"' in x or '\n' in x or '\r' in x:
+        x = '"' + x.replace('"', '""') + '"'
+    return x.encode()
+
 class DataLogger:
-    """Loguje data z DUT do CSV souboru v samostatném vlákně."""
+    """
+    Loguje data z DUT do CSV souboru. Vzorkovací vlákno jen čte DUT a vkládá surové snímky do fronty,
+    formátování a zápis na disk dělá samostatné vlákno po dávkách - pomalý disk tak nezpozdí vzorkování.
+    """
+    WRITE_BUFFER_SIZE = 128 * 1024 # Buffer souboru - dávky jdou na disk jedním write()
+    BATCH_MAX_ROWS = 64 # Dávka se zapíše po naplnění...
+    BATCH_MAX_AGE_S = 1.0 # ...nebo nejpozději po této době
+    LINE_END = b"\r\n" # Stejné zakončení řádků jako dřívější csv.writer
+
     def __init__(self, dut: 'DutControllerTypes', log_interval_s: float, output_file: Path):
         if dut is None:
              raise ValueError("DUT controller object cannot be None for DataLogger.")
@@ -20,13 +38,21 @@ class DataLogger:
         self.log_interval = max(0.1, log_interval_s) # Min interval 100ms
         self.output_file = output_file
         self._log_thread: threading.Thread | None = None
+        self._writer_thread: threading.Thread | None = None
+        self._row_queue: queue.SimpleQueue = queue.SimpleQueue() # (snímek, fáze) od vzorkovače; None = konec
         self._stop_event = threading.Event()
+        self._file: IO[bytes] | None = None # Otevřený CSV soubor, binárně (hlavička i data jedním handlem)
         self.is_logging = False
         self.logged_data_file: Path | None = None
         self.header = [ # Definice hlavičky podle test_log.csv
             'time', 'vbat', 'ibat', 'ntc_temp', 'vsys',
-            'die_temp', 'iba_meas_status', 'buck_status', 'mode'
+            'die_temp', 'iba_meas_status', 'buck_status', 'mode', 'phase'
         ]
+        self.phase = "" # Aktuální fáze testu (discharge/charge/...) - zapisuje se do každého řádku
+
+    def set_phase(self, phase: str):
+        """Nastaví fázi testu, kterou se označí následující řádky logu."""
+        self.phase = phase
 
     def start_logging(self) -> bool:
         if self.is_logging:
@@ -39,80 +65,110 @@ class DataLogger:
             self.logged_data_file = self.output_file
             logging.info(f"DataLogger: Starting logging to {self.output_file} every {self.log_interval:.1f}s")
 
-            with open(self.output_file, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(self.header) # Zápis hlavičky
+            # Binárně - řádky se skládají rovnou jako bytes, bez TextIOWrapperu (kódování, překlad konců řádků)
+            self._file = open(self.output_file, 'wb', buffering=self.WRITE_BUFFER_SIZE)
+            self._file.write(",".join(self.header).encode() + self.LINE_END) # Zápis hlavičky
 
+            self._row_queue = queue.SimpleQueue()
+            self._writer_thread = threading.Thread(target=self._writer_loop, name=f"DataWriter-{self.output_file.stem}", daemon=True)
             self._log_thread = threading.Thread(target=self._logging_loop, name=f"DataLogger-{self.output_file.stem}", daemon=True)
             self.is_logging = True
+            self._writer_thread.start()
             self._log_thread.start()
             return True
         except IOError as e:
             logging.error(f"DataLogger: Could not open log file {self.output_file} for writing: {e}")
             self.logged_data_file = None
+            self._close_file()
             return False
         except Exception as e:
              logging.exception(f"DataLogger: Unexpected error during logger start: {e}")
+             self._close_file()
              return False
 
+    def _close_file(self):
+        """Vyprázdní buffer a zavře CSV soubor (bezpečné volat opakovaně)."""
+        f, self._file = self._file, None
+        if f is not None:
+            try: f.close()
+            except OSError as e: logging.error(f"DataLogger: Error closing log file {self.output_file}: {e}")
+
+    @staticmethod
+    def _format_row(snapshot: tuple, phase: str) -> bytes:
+        """Převede snímek z DUT (pořadí jako get_snapshot()) na hotový řádek CSV - bez csv modulu, schéma je pevné."""
+        dut_time, vbat, ibat, ntc_temp, vsys, die_temp, iba_status, buck_status, mode = snapshot
+        return b"%s,%s,%s,%s,%s,%s,%s,%s,%s,%s\r\n" % (
+            b"" if dut_time is None else b"%09d" % dut_time, _f3(vbat), _f3(ibat), _f3(ntc_temp),
+            _f3(vsys), _f3(die_temp), _text(iba_status), _text(buck_status), _text(mode), _text(phase))
+
+    def _writer_loop(self):
+        """Formátuje snímky z fronty a zapisuje je do CSV po dávkách (BATCH_MAX_ROWS / BATCH_MAX_AGE_S) až do značky None."""
+        format_row = self._format_row
+        get, get_nowait = self._row_queue.get, self._row_queue.get_nowait
+        try:
+            with self._file as f: # Soubor otevřený v start_logging() - zavře se (a vyprázdní buffer) na konci
+                batch: list = []
+                deadline = time.monotonic() + self.BATCH_MAX_AGE_S
+                done = False
+                while not done:
+                    try:
+                        item = get(timeout=max(0.0, deadline - time.monotonic())) # Spí, dokud fronta není neprázdná
+                        while item is not None:
+                            batch.append(format_row(*item))
+                            item = get_nowait() # Vybere vše, co se mezitím nahromadilo, bez dalšího čekání
+                        done = True
+                    except queue.Empty:
+                        pass
+                    if batch and (done or len(batch) >= self.BATCH_MAX_ROWS or time.monotonic() >= deadline):
+                        f.write(b"".join(batch))
+                        f.flush()
+                        batch.clear()
+                    if time.monotonic() >= deadline:
+                        deadline = time.monotonic() + self.BATCH_MAX_AGE_S
+        except (IOError, ValueError) as e: # ValueError = zápis do již zavřeného souboru
+             logging.error(f"DataLogger: IO Error during writing to {self.output_file}: {e}")
+        finally:
+             self._close_file()
+
     def _logging_loop(self):
-        logging.debug(f"DataLogger: Logging loop started for {self.output_file.name}.")
+        logging.debug("DataLogger: Logging loop started for %s.", self.output_file.name)
+        put_row = self._row_queue.put
+        get_snapshot = self.dut.get_snapshot # Všechna měření jedním voláním
+        monotonic_ns = time.monotonic_ns
+        interval_ns = int(self.log_interval * 1e9) # Časování v celých ns - bez float mezivýsledků v každém kroku
         try:
-            with open(self.output_file, 'a', newline='') as f:
-                writer = csv.writer(f)
-                while not self._stop_event.is_set():
-                    loop_start_time = time.monotonic()
+            while not self._stop_event.is_set():
+                loop_start_ns = monotonic_ns()
 
-                    # Získání všech dat z DUT
-                    try:
-                        dut_time = self.dut.get_dut_timestamp()
-                        vbat = self.dut.get_battery_voltage()
-                        ibat = self.dut.get_battery_current()
-                        ntc_temp = self.dut.get_ntc_temp()
-                        vsys = self.dut.get_vsys()
-                        die_temp = self.dut.get_die_temp()
-                        iba_status = self.dut.get_iba_meas_status()
-                        buck_status = self.dut.get_buck_status()
-                        mode = self.dut.get_operation_mode()
-                    except Exception as e:
-                         logging.error(f"DataLogger: Error getting data from DUT: {e}")
-                         # Pokračovat a zapsat prázdné hodnoty? Nebo přeskočit?
-                         # Prozatím přeskočíme tento cyklus logování
-                         time.sleep(self.log_interval / 2) # Krátká pauza
-                         continue
-
-                    # Formátování a zápis řádku
-                    writer.writerow([
-                        f"{dut_time:09d}" if dut_time is not None else "",
-                        f"{vbat:.3f}" if vbat is not None else "",
-                        f"{ibat:.3f}" if ibat is not None else "",
-                        f"{ntc_temp:.3f}" if ntc_temp is not None else "",
-                        f"{vsys:.3f}" if vsys is not None else "",
-                        f"{die_temp:.3f}" if die_temp is not None else "",
-                        iba_status if iba_status is not None else "",
-                        buck_status if buck_status is not None else "",
-                        mode if mode is not None else ""
-                    ])
-                    # f.flush() # Není obvykle nutné, může zpomalit
-
-                    # Výpočet a čekání
-                    elapsed_time = time.monotonic() - loop_start_time
-                    sleep_time = max(0, self.log_interval - elapsed_time)
-                    if sleep_time > 0:
-                       # wait() je přerušitelné událostí stop_event
-                       self._stop_event.wait(sleep_time)
+                # Získání všech dat z DUT
+                try:
+                    snapshot = get_snapshot()
+                except Exception as e:
+                     logging.error("DataLogger: Error getting data from DUT: %s", e)
+                     # Pokračovat a zapsat prázdné hodnoty? Nebo přeskočit?
+                     # Prozatím přeskočíme tento cyklus logování
+                     time.sleep(self.log_interval / 2) # Krátká pauza
+                     continue
+
+                # Formátování i zápis na disk obstará _writer_loop
+                put_row((snapshot, self.phase))
+
+                # Výpočet a čekání
+                remaining_ns = interval_ns - (monotonic_ns() - loop_start_ns)
+                if remaining_ns > 0:
+                   # wait() je přerušitelné událostí stop_event
+                   self._stop_event.wait(remaining_ns * 1e-9)
 
-        except IOError as e:
-             logging.error(f"DataLogger: IO Error during logging to {self.output_file}: {e}")
         except Exception as e:
              # Logování výjimky včetně tracebacku
              logging.exception(f"DataLogger: Unexpected error in logging loop for {self.output_file.name}: {e}")
         finally:
+             put_row(None) # Writer zapíše zbytek dávky a zavře soubor
              logging.info(f"DataLogger: Logging thread stopped for {self.output_file.name}.")
              self.is_logging = False # Důležité nastavit až po ukončení vlákna
 
     def stop_logging(self) -> Path | None:
-        """Zastaví logování dat."""
+        """Zastaví logování dat. Opakované volání (nebo volání bez spuštění) jen vrátí cestu k souboru."""
         if not self.is_logging or self._log_thread is None:
             return self.logged_data_file # Vrátí cestu, pokud byla nastavena
 
@@ -123,8 +179,14 @@ class DataLogger:
 
         if self._log_thread.is_alive():
             logging.warning(f"DataLogger: Logging thread for {self.output_file.name} did not stop gracefully.")
+            self._row_queue.put(None) # Vzorkovač visí (např. na DUT) - ukončíme writer sami
         else:
-             logging.debug(f"DataLogger: Logging thread for {self.output_file.name} joined successfully.")
+             logging.debug("DataLogger: Logging thread for %s joined successfully.", self.output_file.name)
+        if self._writer_thread is not None:
+            self._writer_thread.join(timeout=join_timeout)
+            if self._writer_thread.is_alive():
+                logging.warning(f"DataLogger: Writer thread for {self.output_file.name} did not stop gracefully.")
+            self._writer_thread = None
 
         self.is_logging = False # Až po join()
         self._log_thread = None
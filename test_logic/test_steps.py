@@ -1,7 +1,13 @@
 # test_logic/test_steps.py
 
+import asyncio
+import enum
 import time
+import errno
 import logging
+import os
+import shutil
+from datetime import datetime
 from pathlib import Path
 import random # Pro Random Wonder test
 from typing import TYPE_CHECKING, Optional
@@ -15,11 +21,56 @@ if TYPE_CHECKING:
     DutControllerTypes = DutController | DummyDutController
     from test_logic.data_logger import DataLogger
 
-# ... (_notify_dut_relay_state - stejná) ...
-def _notify_dut_relay_state(dut: 'DutControllerTypes', relay_state: dict):
-    if hasattr(dut, 'notify_usb_connected'): dut.notify_usb_connected(relay_state.get('usb_connected', False)) # type: ignore
-    if hasattr(dut, 'notify_charger_hw_enabled'): dut.notify_charger_hw_enabled(relay_state.get('charger_hw_enabled', False)) # type: ignore
+def _notify_dut_relay_state(dut: 'DutControllerTypes', usb_connected: bool, charger_hw_enabled: bool):
+    # getattr s výchozí hodnotou = jedno vyhledání místo hasattr + volání přes atribut
+    notify_usb = getattr(dut, 'notify_usb_connected', None)
+    if notify_usb is not None: notify_usb(usb_connected)
+    notify_charger = getattr(dut, 'notify_charger_hw_enabled', None)
+    if notify_charger is not None: notify_charger(charger_hw_enabled)
 
+def _enter_charging(dut: 'DutControllerTypes', relay: 'RelayController', force_discharge=None):
+    """Zapne nabíjení (relé + SW příkaz) a ukončí vynucené vybíjení Dummy DUT. Předpoklad: USB je připojeno."""
+    relay.enable_charger_hw()
+    dut.enable_charging_sw()
+    _notify_dut_relay_state(dut, True, True)
+    if force_discharge is not None: force_discharge(False)
+
+def _enter_discharging(dut: 'DutControllerTypes', relay: 'RelayController', force_discharge=None,
+                       forced: bool = True, usb_connected: bool = True):
+    """Vypne nabíjení (SW příkaz + relé); forced=True spustí vynucené vybíjení Dummy DUT, False ho ukončí."""
+    dut.disable_charging_sw()
+    relay.disable_charger_hw()
+    _notify_dut_relay_state(dut, usb_connected, False)
+    if force_discharge is not None: force_discharge(forced)
+    # Zde by byla logika pro aktivní vybíjení reálného DUT, pokud existuje
+
+
+class _DutSafeState:
+    """
+    Obalí běh kroku: při ukončení (normálním, výjimkou i zrušením) vypne nabíjení (SW i relé)
+    a ukončí vynucené vybíjení Dummy DUT. Jediné místo úklidu místo finally bloků v každém kroku.
+    """
+    def __init__(self, dut: 'DutControllerTypes', relay: 'RelayController', message: str, usb_connected: bool = True):
+        self.dut = dut
+        self.relay = relay
+        self.message = message
+        self.usb_connected = usb_connected # Stav USB relé během kroku - jen pro notifikaci Dummy DUT
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        logging.info(self.message)
+        _enter_discharging(self.dut, self.relay, getattr(self.dut, 'force_discharge_mode', None),
+                           forced=False, usb_connected=self.usb_connected)
+        return False # Výjimku nepolykáme
+
+
+_NA = "N/A" # Chybějící hodnota ve stavových logech
+
+def _eta_str(seconds_from_now: float) -> str:
+    """Místní čas HH:MM:SS za daný počet sekund (pro logy 'until ...')."""
+    return datetime.fromtimestamp(time.time() + seconds_from_now).strftime('%H:%M:%S')
 
 # --- Stávající kroky (mírně upravené pro logování) ---
 
@@ -31,25 +82,30 @@ def step_set_temp(temp_ctl: 'TempController', temp_c: float) -> bool:
     logging.info("Target temperature set instruction sent/logged.")
     return True
 
-def step_relax(duration_s: int, step_name: str):
+async def step_relax(duration_s: int, step_name: str):
     # ... (Funkce beze změny, jen používá logging) ...
     logging.info(f"--- STEP {step_name}: Relaxing for {duration_s / 3600:.1f} hour(s) ({duration_s} seconds) ---")
     if duration_s <= 0: logging.info("Relaxation duration is zero or negative, skipping."); return
-    end_time = time.monotonic() + duration_s
-    log_interval = 60
-    next_log_time = time.monotonic() + log_interval
-    logging.info(f"Relaxation started. Ends approx. at {time.strftime('%H:%M:%S', time.localtime(time.time() + duration_s))}")
-    while time.monotonic() < end_time:
-        current_time = time.monotonic(); remaining_time = end_time - current_time
-        if current_time >= next_log_time:
-             logging.info(f"  Relaxing... {remaining_time / 60:.1f} minute(s) remaining.")
-             next_log_time += log_interval
-        sleep_duration = min(1.0, remaining_time, next_log_time - current_time)
-        if sleep_duration > 0: time.sleep(sleep_duration)
+    log_interval_s = 60
+    if duration_s <= log_interval_s: # Krátká relaxace - průběžný log by se stejně neuplatnil
+        await asyncio.sleep(duration_s); logging.info("Relaxation complete."); return
+    _mono = time.monotonic_ns # Celočíselné ns - bez driftu při next_log_ns += log_interval_ns
+    end_ns = _mono() + int(duration_s * 1_000_000_000)
+    log_interval_ns = log_interval_s * 1_000_000_000
+    next_log_ns = _mono() + log_interval_ns
+    logging.info(f"Relaxation started. Ends approx. at {_eta_str(duration_s)}")
+    while (now_ns := _mono()) < end_ns:
+        remaining_ns = end_ns - now_ns
+        if now_ns >= next_log_ns:
+             logging.info("  Relaxing... %.1f minute(s) remaining.", remaining_ns / 60e9)
+             next_log_ns += log_interval_ns
+        # Spí až do dalšího logu / konce - bez 1s stropu; Ctrl+C zruší asyncio.sleep okamžitě
+        sleep_ns = min(remaining_ns, next_log_ns - now_ns)
+        if sleep_ns > 0: await asyncio.sleep(sleep_ns / 1e9)
     logging.info("Relaxation complete.")
 
 # --- ZMĚNA: Logger se předává, ale nestartuje/nestopuje uvnitř ---
-def step_discharge(dut: 'DutControllerTypes', relay: 'RelayController', logger: 'DataLogger', config: dict) -> bool:
+async def step_discharge(dut: 'DutControllerTypes', relay: 'RelayController', logger: 'DataLogger', config: dict) -> bool:
     """Krok Vybíjení (použito v Linear módu). Logger musí běžet."""
     discharge_limit_v = config['linear_discharge_voltage_limit'] # Použijeme specifický parametr
     logging.info(f"--- STEP Discharge (Linear): Discharging to {discharge_limit_v:.2f} V ---")
@@ -60,52 +116,79 @@ def step_discharge(dut: 'DutControllerTypes', relay: 'RelayController', logger:
 
     logging.info("Configuring hardware for discharge...")
     # ... (Nastavení relé a notifikace dummy - stejné) ...
-    relay.disconnect_usb()
     dut.disable_charging_sw()
-    relay.disable_charger_hw()
-    _notify_dut_relay_state(dut, {'usb_connected': False, 'charger_hw_enabled': False})
+    relay.apply_state(usb=False, charger_hw=False) # USB odpojit + HW nabíjení vypnout jedním příkazem
+    _notify_dut_relay_state(dut, False, False)
 
     discharge_started = False
-    if hasattr(dut, 'force_discharge_mode'):
+    force_discharge = getattr(dut, 'force_discharge_mode', None) # Jen Dummy DUT; zjistí se jednou za krok
+    if force_discharge is not None:
         logging.info("Telling Dummy DUT to start discharging...")
-        dut.force_discharge_mode(True); discharge_started = True # type: ignore
+        force_discharge(True); discharge_started = True
     else:
         logging.info("Assuming real DUT/external load handles discharge initiation.")
         # Zde logika pro reálné DUT, pokud potřebuje start
         discharge_started = True
 
     if not discharge_started: logging.error("Could not initiate discharge process."); return False
-    time.sleep(2)
+
+    # Místo pevné 2s pauzy: počkat na první pokles napětí (vybíjení se rozběhlo), nejvýše 2 s
+    _mono = time.monotonic_ns
+    to_thread, read_voltage = asyncio.to_thread, dut.get_battery_voltage # Lokální aliasy pro smyčky kroku
+    settle_deadline_ns = _mono() + 2_000_000_000
+    v_start = await to_thread(read_voltage)
+    while v_start is not None and _mono() < settle_deadline_ns:
+        await asyncio.sleep(0.1)
+        voltage = await to_thread(read_voltage)
+        if voltage is not None and voltage < v_start: break
 
     logging.info("Discharging...")
-    last_voltage_print_time = 0
+    print_interval_ns = 15 * 1_000_000_000
+    last_voltage_print_ns = 0
     monitoring_interval = 1
-
-    try:
-        while True:
-            voltage = dut.get_battery_voltage()
-            if voltage is None: logging.warning("Failed to read voltage during discharge. Retrying..."); time.sleep(5); continue
-
-            current_time = time.monotonic()
-            if current_time - last_voltage_print_time > 15:
-                 logging.info(f"  Discharging... V={voltage:.3f}V (Target: {discharge_limit_v:.2f}V)")
-                 last_voltage_print_time = current_time
-
-            if voltage <= discharge_limit_v:
-                logging.info(f"Discharge limit reached at {voltage:.3f} V.")
-                break
-
-            sleep_s = max(monitoring_interval, logger.log_interval / 2)
-            time.sleep(sleep_s)
-
-    except KeyboardInterrupt:
-         logging.warning("\nDischarge interrupted by user.")
-         if hasattr(dut, 'force_discharge_mode'): dut.force_discharge_mode(False) # type: ignore
-         return False
-    finally:
-        logging.info("Stopping discharge process (hardware/simulation)...")
-        if hasattr(dut, 'force_discharge_mode'): dut.force_discharge_mode(False) # type: ignore
-        # Zde stop pro reálné DUT
+    min_sleep_s = max(monitoring_interval, logger.log_interval / 2) # Neměnné během kroku
+    max_sleep_s = 30.0
+    sleep_per_volt_s = 60.0 # Úměrný poll: 0.5 V nad limitem = 30 s
+    near_limit_v = 0.1 # Blízko limitu (koleno křivky) vždy krátký poll
+    peak_rate_v_per_s = 0.0 # Nejrychlejší dosud pozorovaný pokles - spánek nesmí přestřelit near_limit_v
+    prev_voltage, prev_ns = None, 0
+    retry_delay_s = 0.2 # Exponenciální back-off při chybě čtení: 0.2 -> 0.4 -> ... -> max 5 s
+
+    # Při ukončení (i přerušení/výjimce) zastaví vybíjení; USB zůstává odpojené
+    with _DutSafeState(dut, relay, "Stopping discharge process (hardware/simulation)...", usb_connected=False):
+        try:
+            while True:
+                voltage = await to_thread(read_voltage) # Blokující čtení (sériová linka) mimo smyčku událostí
+                if voltage is None:
+                    logging.warning("Failed to read voltage during discharge. Retrying in %.1fs...", retry_delay_s)
+                    await asyncio.sleep(retry_delay_s); retry_delay_s = min(retry_delay_s * 2, 5.0)
+                    continue
+                retry_delay_s = 0.2
+
+                now_ns = _mono()
+                if now_ns - last_voltage_print_ns > print_interval_ns:
+                     logging.info("  Discharging... V=%.3fV (Target: %.2fV)", voltage, discharge_limit_v)
+                     last_voltage_print_ns = now_ns
+
+                if voltage <= discharge_limit_v:
+                    logging.info(f"Discharge limit reached at {voltage:.3f} V.")
+                    break
+
+                # Adaptivní poll úměrný vzdálenosti od limitu, shora omezený časem do near_limit_v při
+                # nejrychlejším pozorovaném poklesu (šum rychlost jen zvýší -> kratší spánek, nikdy delší)
+                if prev_voltage is not None and prev_voltage > voltage:
+                    peak_rate_v_per_s = max(peak_rate_v_per_s, (prev_voltage - voltage) * 1e9 / (now_ns - prev_ns))
+                prev_voltage, prev_ns = voltage, now_ns
+                gap_v = voltage - discharge_limit_v
+                sleep_s = min_sleep_s
+                if gap_v > near_limit_v and peak_rate_v_per_s > 0:
+                    sleep_s = min(gap_v * sleep_per_volt_s, (gap_v - near_limit_v) / peak_rate_v_per_s, max_sleep_s)
+                    sleep_s = max(min_sleep_s, sleep_s)
+                await asyncio.sleep(sleep_s)
+
+        except asyncio.CancelledError: # Ctrl+C - asyncio.run() zruší běžící krok
+             logging.warning("\nDischarge interrupted by user.")
+             raise
 
     logging.info("Discharge step complete.")
     return True
@@ -115,11 +198,9 @@ def step_connect_usb_disable_charge(relay: 'RelayController', dut: 'DutControlle
     logging.info("--- STEP Connect USB / Disable Charge ---")
     logging.info("Sending SW disable charging command...")
     if not dut.disable_charging_sw(): logging.warning("Failed SW disable command.")
-    logging.info("Disabling charger HW via relay...")
-    relay.disable_charger_hw()
-    logging.info("Connecting USB via relay...")
-    relay.connect_usb()
-    _notify_dut_relay_state(dut, {'usb_connected': True, 'charger_hw_enabled': False})
+    logging.info("Disabling charger HW and connecting USB via relay...")
+    relay.apply_state(usb=True, charger_hw=False) # Jeden zápis do relé desky místo dvou
+    _notify_dut_relay_state(dut, True, False)
     logging.info("USB connected, charging should be disabled.")
     return True
 
@@ -127,16 +208,16 @@ def step_enable_charging(relay: 'RelayController', dut: 'DutControllerTypes') ->
     # ... (Funkce beze změny - jen používá logging) ...
     logging.info("--- STEP Enable Charging ---")
     logging.info("Enabling charger HW via relay...")
-    relay.enable_charger_hw()
+    relay.apply_state(usb=True, charger_hw=True)
     logging.info("Sending SW enable charging command...")
     sw_success = dut.enable_charging_sw()
-    _notify_dut_relay_state(dut, {'usb_connected': True, 'charger_hw_enabled': True})
+    _notify_dut_relay_state(dut, True, True)
     if not sw_success: logging.warning("Failed SW enable command.")
     logging.info("Charging enabled (HW relay ON, SW command sent).")
     return True
 
 # --- ZMĚNA: Logger se předává, ale nestartuje/nestopuje uvnitř ---
-def step_charge(dut: 'DutControllerTypes', logger: 'DataLogger', config: dict) -> bool:
+async def step_charge(dut: 'DutControllerTypes', logger: 'DataLogger', config: dict) -> bool:
     """Krok Nabíjení (použito v Linear módu). Logger musí běžet."""
     idle_current_threshold = config['linear_charge_idle_current_threshold_ma'] # Specifický parametr
     logging.info(f"--- STEP Charge (Linear): Charging until IDLE (Current < {idle_current_threshold} mA) ---")
@@ -145,44 +226,64 @@ def step_charge(dut: 'DutControllerTypes', logger: 'DataLogger', config: dict) -
         logging.error("Charge step cannot run: DataLogger is not active.")
         return False
 
-    start_time = time.monotonic()
+    _mono = time.monotonic_ns
+    start_ns = _mono()
     max_charge_time_s = config.get('test_plan', {}).get('max_charge_time_hours', 10) * 3600
-    last_status_print_time = 0
+    status_interval_ns = 30 * 1_000_000_000
     verification_period_s = 30
-    stable_end_detected = False
-    verification_start_time = 0
-    monitoring_interval = 5
+    monitoring_interval = 10 # Poll DUT registrů; ověření stability (30 s) má stále >= 3 vzorky
+
+    async def charge_loop():
+        to_thread, read_status = asyncio.to_thread, dut.get_status # Lokální aliasy pro smyčku
+        neg_idle_threshold = -idle_current_threshold # |I| < práh jako řetězené porovnání bez abs()
+        # Monitorování až do stabilního konce nabíjení; celkový timeout hlídá wait_for níže
+        last_status_print_ns = 0
+        stable_timer: Optional[asyncio.Task] = None # Běží, dokud podmínka konce platí; doběhne = stabilní konec
+        try:
+            while True:
+                mode, current, voltage = await to_thread(read_status)
+                if mode is None and current is None: logging.warning("Failed read mode/current. Retrying..."); await asyncio.sleep(monitoring_interval); continue
+                now_ns = _mono()
+                if now_ns - last_status_print_ns > status_interval_ns:
+                     logging.info("  Charging...(%.1fm): Mode=%s, I=%s, V=%s", (now_ns - start_ns) / 60e9,
+                                  mode if mode is not None else _NA, "%.1fmA" % current if current is not None else _NA,
+                                  "%.3fV" % voltage if voltage is not None else _NA)
+                     last_status_print_ns = now_ns
+
+                charge_ended_condition = (mode=="IDLE") or (current is not None and neg_idle_threshold < current < idle_current_threshold)
+                # Časovač se spouští/ruší jen na hranách podmínky
+                if charge_ended_condition and stable_timer is None:
+                    logging.info("Charge end condition detected. Verifying...")
+                    stable_timer = asyncio.create_task(asyncio.sleep(verification_period_s))
+                elif not charge_ended_condition and stable_timer is not None:
+                    logging.info("Charge termination unstable. Resetting.")
+                    stable_timer.cancel(); stable_timer = None
+
+                if stable_timer is None:
+                    # Daleko od konce (velký proud) se polluje řidčeji, nejvýše po 30 s; u prahu zpět na monitoring_interval
+                    poll_s = monitoring_interval
+                    if current is not None: poll_s = min(monitoring_interval * max(1.0, abs(current) / idle_current_threshold), 30.0)
+                    await asyncio.sleep(poll_s)
+                else:
+                    # Probudí se při dalším pollu nebo hned, jak časovač doběhne
+                    await asyncio.wait((stable_timer,), timeout=monitoring_interval)
+                    if stable_timer.done(): logging.info("Charge termination stable."); return
+        finally:
+            if stable_timer is not None: stable_timer.cancel() # Timeout / přerušení kroku
 
     try:
-        while time.monotonic() - start_time < max_charge_time_s:
-            # ... (Smyčka monitorování - stejná jako předtím, jen používá logging) ...
-            current_monotonic_time = time.monotonic()
-            mode = dut.get_operation_mode(); current = dut.get_battery_current(); voltage = dut.get_battery_voltage()
-            if mode is None and current is None: logging.warning("Failed read mode/current. Retrying..."); time.sleep(monitoring_interval); continue
-            if current_monotonic_time - last_status_print_time > 30:
-                 mode_str=f"Mode={mode}" if mode is not None else "N/A"; curr_str=f"I={current:.1f}mA" if current is not None else "N/A"; volt_str=f"V={voltage:.3f}V" if voltage is not None else "N/A"
-                 elapsed_m=(current_monotonic_time - start_time)/60; logging.info(f"  Charging...({elapsed_m:.1f}m): {mode_str}, {curr_str}, {volt_str}")
-                 last_status_print_time = current_monotonic_time
-
-            charge_ended_condition = (mode=="IDLE") or (current is not None and abs(current) < idle_current_threshold)
-            if charge_ended_condition:
-                if not stable_end_detected: logging.info("Charge end condition detected. Verifying..."); stable_end_detected=True; verification_start_time=current_monotonic_time
-                elif current_monotonic_time - verification_start_time >= verification_period_s: logging.info("Charge termination stable."); break
-                else: logging.debug(f"  Verifying stability... {current_monotonic_time - verification_start_time:.0f}/{verification_period_s:.0f}s")
-            elif stable_end_detected: logging.info("Charge termination unstable. Resetting."); stable_end_detected=False
-            time.sleep(monitoring_interval)
-        else:
-             logging.error(f"Charging timeout after {max_charge_time_s / 3600:.1f} hours.")
-             return False
-    except KeyboardInterrupt: logging.warning("\nCharging interrupted."); return False
-    finally: pass # Logger se stopne v main
+        await asyncio.wait_for(charge_loop(), timeout=max_charge_time_s) # Timeout zruší smyčku i uprostřed čekání
+    except asyncio.TimeoutError:
+        logging.error(f"Charging timeout after {max_charge_time_s / 3600:.1f} hours.")
+        return False
+    except asyncio.CancelledError: logging.warning("\nCharging interrupted."); raise # Logger se stopne v main
 
     logging.info("Charging step complete.")
     return True
 
 # --- NOVÉ KROKY pro nové módy ---
 
-def step_switching_phase(dut: 'DutControllerTypes', relay: 'RelayController', logger: 'DataLogger', config: dict) -> bool:
+async def step_switching_phase(dut: 'DutControllerTypes', relay: 'RelayController', logger: 'DataLogger', config: dict) -> bool:
     """Provádí fázi Switching Testu."""
     duration_s = config.get('switching_phase_duration_s', 300) # Default 5 min
     interval_s = config.get('switching_interval_s', 5)       # Default 5s
@@ -192,175 +293,220 @@ def step_switching_phase(dut: 'DutControllerTypes', relay: 'RelayController', lo
 
     if not logger.is_logging: logging.error("Switching step: Logger not active."); return False
     if interval_s <= 0: logging.error("Switching interval must be positive."); return False
-
-    start_time = time.monotonic()
-    end_time = start_time + duration_s
+    send_command = getattr(dut, '_send_command', None) # Reálné DUT
+    is_dummy = hasattr(dut, 'force_discharge_mode')
+    # Popisky pro log a pauza se nemění během kroku - spočítat jednou
+    dut_cmds = config.get('dut_commands') or {}
+    switch_labels = (f"OFF (Command: {dut_cmds.get(discharge_cmd_key, 'N/A')})",
+                     f"ON (Command: {dut_cmds.get(charge_cmd_key, 'N/A')})")
+    # Krátká pauza - menší než log interval, ale ne příliš krátká
+    sleep_s = min(max(0.1, logger.log_interval / 5), interval_s / 2)
+
+    _mono = time.monotonic_ns
+    end_ns = _mono() + int(duration_s * 1_000_000_000)
+    interval_ns = int(interval_s * 1_000_000_000)
     switch_state = True # Začneme "zapnutím" (charge command)
-    last_switch_time = 0
-
-    try:
-        while time.monotonic() < end_time:
-            current_monotonic_time = time.monotonic()
-            # Čas na přepnutí?
-            if current_monotonic_time - last_switch_time >= interval_s:
-                last_switch_time = current_monotonic_time
-                switch_state = not switch_state # Přepnout stav
-                command_key = charge_cmd_key if switch_state else discharge_cmd_key
-                logging.info(f"Switching state to {'ON' if switch_state else 'OFF'} (Command: {config.get('dut_commands',{}).get(command_key, 'N/A')})")
-
-                # Odeslání příkazu - použijeme interní _send_command pro přístup přes klíč
-                if hasattr(dut, '_send_command'):
-                    # Zkusíme poslat příkaz, neřešíme zde návratovou hodnotu pro jednoduchost simulace
-                    # Reálná implementace by mohla kontrolovat úspěch
-                    dut._send_command(command_key) # type: ignore
-                elif hasattr(dut, 'force_discharge_mode'): # Pro Dummy DUT
-                     if command_key == 'disable_charging': dut.disable_charging_sw() # Simulace disable
-                     elif command_key == 'enable_charging': dut.enable_charging_sw() # Simulace enable
-                     # Jiné příkazy by zde potřebovaly specifickou simulaci
-                else:
-                     logging.warning("Cannot send switching command - DUT controller type unknown or lacks method.")
-
-                # Ovládání relé (může být redundantní, pokud příkazy ovládají i HW)
-                # Přidáme volitelně ovládání relé pro simulaci enable/disable
-                # if switch_state: relay.enable_charger_hw() # Nebo jen SW příkaz?
-                # else: relay.disable_charger_hw()
-                # _notify_dut_relay_state(dut, {'usb_connected': True, 'charger_hw_enabled': switch_state}) # Potenciálně
-
-            # Krátká pauza - menší než log interval, ale ne příliš krátká
-            sleep_s = min(max(0.1, logger.log_interval / 5), interval_s / 2)
-            time.sleep(sleep_s)
-
-    except KeyboardInterrupt:
-         logging.warning("\nSwitching phase interrupted by user.")
-         return False
-    finally:
-        # Uvést DUT do definovaného stavu? Např. disable charging.
-        logging.info("Switching phase finished. Disabling charging.")
-        dut.disable_charging_sw()
-        relay.disable_charger_hw()
-        _notify_dut_relay_state(dut, {'usb_connected': True, 'charger_hw_enabled': False})
+    last_switch_ns = 0
+
+    # Uvést DUT do definovaného stavu (nabíjení vypnuto) i po přerušení/výjimce
+    with _DutSafeState(dut, relay, "Switching phase finished. Disabling charging."):
+        try:
+            while (now_ns := _mono()) < end_ns:
+                # Čas na přepnutí?
+                if now_ns - last_switch_ns >= interval_ns:
+                    last_switch_ns = now_ns
+                    switch_state = not switch_state # Přepnout stav
+                    command_key = charge_cmd_key if switch_state else discharge_cmd_key
+                    logging.info("Switching state to %s", switch_labels[switch_state])
+
+                    # Odeslání příkazu - použijeme interní _send_command pro přístup přes klíč
+                    if send_command is not None:
+                        # Zkusíme poslat příkaz, neřešíme zde návratovou hodnotu pro jednoduchost simulace
+                        # Reálná implementace by mohla kontrolovat úspěch
+                        send_command(command_key)
+                    elif is_dummy: # Pro Dummy DUT
+                         if command_key == 'disable_charging': dut.disable_charging_sw() # Simulace disable
+                         elif command_key == 'enable_charging': dut.enable_charging_sw() # Simulace enable
+                         # Jiné příkazy by zde potřebovaly specifickou simulaci
+                    else:
+                         logging.warning("Cannot send switching command - DUT controller type unknown or lacks method.")
+
+                    # Ovládání relé (může být redundantní, pokud příkazy ovládají i HW)
+                    # Přidáme volitelně ovládání relé pro simulaci enable/disable
+                    # if switch_state: relay.enable_charger_hw() # Nebo jen SW příkaz?
+                    # else: relay.disable_charger_hw()
+                    # _notify_dut_relay_state(dut, True, switch_state) # Potenciálně
+
+                await asyncio.sleep(sleep_s)
+
+        except asyncio.CancelledError:
+             logging.warning("\nSwitching phase interrupted by user.")
+             raise
 
     logging.info("Switching phase complete.")
     return True
 
 
-def step_random_wonder(dut: 'DutControllerTypes', relay: 'RelayController', logger: 'DataLogger', config: dict) -> bool:
-    """Provádí fázi Random Wonder Testu."""
+class _WonderState(enum.IntEnum):
+    """Stavy Random Wonder testu - příkazy do DUT/relé se posílají jen při změně stavu."""
+    IDLE = 0        # Nabíjení vypnuto, žádné vynucené vybíjení (před první fází a po konci kroku)
+    CHARGING = 1
+    DISCHARGING = 2
+
+async def step_random_wonder(dut: 'DutControllerTypes', relay: 'RelayController', logger: 'DataLogger', config: dict) -> bool:
+    """Provádí fázi Random Wonder Testu (plánovač fází a hlídání napětí běží jako dvě souběžné úlohy)."""
     duration_s = config.get('random_duration_s', 1800) # Default 30 min
     min_phase_s = config.get('random_min_phase_s', 10)
     max_phase_s = config.get('random_max_phase_s', 120)
     charge_prob = config.get('random_charge_probability', 0.6)
     max_v = config.get('random_max_voltage', 4.25)
     min_v = config.get('random_min_voltage', 2.9)
+    seed = config.get('random_seed') # None = nový náhodný plán při každém běhu
     logging.info(f"--- STEP Random Wonder: Duration={duration_s}s ---")
-    logging.info(f"  Params: PhaseTime=({min_phase_s}-{max_phase_s})s, ChargeProb={charge_prob*100}%, V_limits=({min_v}-{max_v})V")
+    logging.info(f"  Params: PhaseTime=({min_phase_s}-{max_phase_s})s, ChargeProb={charge_prob*100}%, V_limits=({min_v}-{max_v})V, Seed={seed}")
 
     if not logger.is_logging: logging.error("Random step: Logger not active."); return False
     if not (0 <= charge_prob <= 1): logging.error("Charge probability must be between 0 and 1."); return False
     if min_phase_s > max_phase_s or min_phase_s <= 0: logging.error("Invalid min/max phase duration."); return False
 
-    start_time = time.monotonic()
-    end_time = start_time + duration_s
-    current_phase_end_time = start_time
-    is_charging_phase = False # Začneme vybíjením nebo IDLE?
-
-    try:
-        while time.monotonic() < end_time:
-            current_monotonic_time = time.monotonic()
-
-            # Je čas na změnu fáze?
-            if current_monotonic_time >= current_phase_end_time:
-                # Náhodná délka další fáze
-                phase_duration = random.uniform(min_phase_s, max_phase_s)
-                current_phase_end_time = current_monotonic_time + phase_duration
-
-                # Náhodný výběr další fáze (nabíjení/vybíjení)
-                previous_phase_charging = is_charging_phase
-                if random.random() < charge_prob:
-                    is_charging_phase = True
-                else:
-                    is_charging_phase = False
-
-                logging.info(f"Random phase change: {'Charging' if is_charging_phase else 'Discharging'} for {phase_duration:.1f}s (until {time.strftime('%H:%M:%S', time.localtime(time.time() + phase_duration))})")
-
-                # Nastavení stavu DUT/Relé
-                if is_charging_phase:
-                    # Zapnout nabíjení
-                    relay.enable_charger_hw() # Předpoklad USB je připojeno
-                    dut.enable_charging_sw()
-                    _notify_dut_relay_state(dut, {'usb_connected': True, 'charger_hw_enabled': True})
-                    if hasattr(dut, 'force_discharge_mode'): dut.force_discharge_mode(False) # Ukončit dummy vybíjení
-                else:
-                    # Zapnout vybíjení (nebo jen vypnout nabíjení)
-                    dut.disable_charging_sw()
-                    relay.disable_charger_hw()
-                    _notify_dut_relay_state(dut, {'usb_connected': True, 'charger_hw_enabled': False})
-                    if hasattr(dut, 'force_discharge_mode'): dut.force_discharge_mode(True) # Spustit dummy vybíjení
-                    # Zde by byla logika pro aktivní vybíjení reálného DUT, pokud existuje
-
+    # Plán fází se vygeneruje předem (délky + typ) - se seedem reprodukovatelný
+    rng = random.Random(seed)
+    def extend_schedule(n: int):
+        durations.extend([rng.uniform(min_phase_s, max_phase_s) for _ in range(n)])
+        charging.extend([rng.random() < charge_prob for _ in range(n)])
+    durations: list[float] = []; charging: list[bool] = []
+    extend_schedule(int(duration_s / min_phase_s) + 8) # Rezerva na fáze zkrácené bezpečnostním limitem
+
+    state = _WonderState.IDLE
+    state_lock = asyncio.Lock() # Plánovač i hlídač mění stav - příkazy do HW se nepřekrývají
+    force_discharge = getattr(dut, 'force_discharge_mode', None) # Jen Dummy DUT
+    phase_interrupted = asyncio.Event() # Nastaví hlídač napětí -> okamžitá změna fáze
+    pending: Optional[asyncio.Future] = None # Poslední příkaz do HW - vlákno zrušením úlohy neskončí
+
+    def apply_state(target: _WonderState):
+        # Jediné místo, které posílá příkazy do DUT/Relé
+        if target is _WonderState.CHARGING: _enter_charging(dut, relay, force_discharge)
+        else: _enter_discharging(dut, relay, force_discharge, forced=target is _WonderState.DISCHARGING) # IDLE vybíjení ukončí
+
+    async def transition(target: _WonderState):
+        # Příkazy se posílají jen při skutečné změně stavu (např. Charging -> Charging nic nepošle)
+        nonlocal state, pending
+        if target is not state:
+            pending = asyncio.ensure_future(asyncio.to_thread(apply_state, target))
+            await asyncio.shield(pending) # Zrušení úlohy nepřeruší rozjetý příkaz; doběhne před úklidem
+            state = target
+
+    def safety_target(voltage: float) -> _WonderState:
+        # Bezpečnostní limity napětí přebíjí plán fází
+        if state is _WonderState.CHARGING and voltage >= max_v: return _WonderState.DISCHARGING
+        if state is _WonderState.DISCHARGING and voltage <= min_v: return _WonderState.CHARGING
+        return state
+
+    async def phase_scheduler():
+        i = 0
+        while True:
+            # Další fáze z plánu (délka a typ nabíjení/vybíjení)
+            if i == len(durations): extend_schedule(len(durations)) # Mnoho zkrácených fází - plán prodloužit
+            phase_duration = durations[i]
+            target = _WonderState.CHARGING if charging[i] else _WonderState.DISCHARGING
+            i += 1
+            logging.info("Random phase change: %s for %.1fs (until %s)", target.name.capitalize(), phase_duration,
+                         _eta_str(phase_duration))
+            async with state_lock:
+                await transition(target)
+                phase_interrupted.clear()
+            try:
+                await asyncio.wait_for(phase_interrupted.wait(), phase_duration)
+            except asyncio.TimeoutError:
+                pass
+
+    async def voltage_watchdog():
+        poll_s = min(max(0.1, logger.log_interval / 2), 1.0)
+        to_thread, read_voltage = asyncio.to_thread, dut.get_battery_voltage # Lokální aliasy pro smyčku
+        while True:
             # Bezpečnostní kontrola napětí
-            voltage = dut.get_battery_voltage()
+            voltage = await to_thread(read_voltage)
             if voltage is not None:
-                if is_charging_phase and voltage >= max_v:
-                    logging.warning(f"Random: Max voltage limit {max_v}V reached during charge. Forcing discharge/idle.")
-                    is_charging_phase = False # Přepnout na vybíjení/idle
-                    current_phase_end_time = current_monotonic_time # Okamžitá změna fáze
-                    dut.disable_charging_sw(); relay.disable_charger_hw()
-                    _notify_dut_relay_state(dut, {'usb_connected': True, 'charger_hw_enabled': False})
-                    if hasattr(dut, 'force_discharge_mode'): dut.force_discharge_mode(True)
-                elif not is_charging_phase and voltage <= min_v:
-                     logging.warning(f"Random: Min voltage limit {min_v}V reached during discharge. Forcing charge/idle.")
-                     is_charging_phase = True # Přepnout na nabíjení/idle
-                     current_phase_end_time = current_monotonic_time
-                     relay.enable_charger_hw(); dut.enable_charging_sw()
-                     _notify_dut_relay_state(dut, {'usb_connected': True, 'charger_hw_enabled': True})
-                     if hasattr(dut, 'force_discharge_mode'): dut.force_discharge_mode(False)
-
-            # Čekání
-            sleep_s = min(max(0.1, logger.log_interval / 2), current_phase_end_time - current_monotonic_time, 1.0)
-            if sleep_s > 0: time.sleep(sleep_s)
-            else: time.sleep(0.05) # Krátká pauza, pokud je konec fáze blízko
-
-    except KeyboardInterrupt:
-         logging.warning("\nRandom wonder phase interrupted by user.")
-         return False
-    finally:
-        # Uvést do definovaného stavu (např. nabíjení vypnuto)
-        logging.info("Random wonder phase finished. Disabling charging.")
-        dut.disable_charging_sw()
-        relay.disable_charger_hw()
-        _notify_dut_relay_state(dut, {'usb_connected': True, 'charger_hw_enabled': False})
-        if hasattr(dut, 'force_discharge_mode'): dut.force_discharge_mode(False)
+                async with state_lock:
+                    target = safety_target(voltage)
+                    if target is not state:
+                        if target is _WonderState.DISCHARGING:
+                            logging.warning("Random: Max voltage limit %sV reached during charge. Forcing discharge/idle.", max_v)
+                        else:
+                            logging.warning("Random: Min voltage limit %sV reached during discharge. Forcing charge/idle.", min_v)
+                        await transition(target)
+                        phase_interrupted.set() # Okamžitá změna fáze
+            await asyncio.sleep(poll_s)
+
+    # Uvést do definovaného stavu (nabíjení vypnuto) - vždy, i když stav tvrdí IDLE (přerušený příkaz)
+    with _DutSafeState(dut, relay, "Random wonder phase finished. Disabling charging."):
+        tasks = [asyncio.create_task(phase_scheduler()), asyncio.create_task(voltage_watchdog())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=duration_s, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done: task.result() # Chyba v úloze se propaguje sem
+
+        except asyncio.CancelledError:
+             logging.warning("\nRandom wonder phase interrupted by user.")
+             raise
+        finally:
+            for task in tasks: task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Rozjetý přechod (např. zapnutí nabíjení) musí doběhnout dřív, než úklid nabíjení vypne
+            if pending is not None: await asyncio.gather(pending, return_exceptions=True)
 
     logging.info("Random wonder step complete.")
     return True
 
 
 # --- ZMĚNA: step_store_files přijímá upravený test_phase ---
-def step_store_files(log_file: Path | None, output_dir: Path, temp_c: float, cycle_num: int, test_phase: str) -> Path | None:
-    """Přejmenuje a uloží log soubor."""
+_created_dirs: set[Path] = set() # Cílové adresáře už vytvořené v tomto běhu (mkdir jen jednou)
+
+def log_target_path(output_dir: Path, temp_c: float, cycle_num: int, test_phase: str,
+                    target_name: Optional[str] = None) -> Path:
+    """Finální cesta logu: output_dir/temp_XXC/cycle_N/<název>. DataLogger do ní může psát rovnou."""
+    # Finální název souboru: TempC_cycleN_Mode.csv
+    # test_phase zde bude název módu, např. "linear", "switching", "random" (fáze jsou ve sloupci phase)
+    target_filename = target_name or f"{temp_c:.0f}C_cycle{cycle_num+1}_{test_phase}.csv"
+    return output_dir / f"temp_{temp_c:.0f}C" / f"cycle_{cycle_num+1}" / target_filename
+
+def step_store_files(log_file: Path | None, output_dir: Path, temp_c: float, cycle_num: int, test_phase: str,
+                     target_name: Optional[str] = None) -> Path | None:
+    """Přejmenuje a uloží log soubor. target_name (pokud je zadán) přebije název sestavený z teploty/cyklu/fáze."""
     logging.info(f"--- Storing Log File for Phase: {test_phase} ---")
-    if log_file is None or not log_file.exists():
-        logging.warning(f"Temporary log file {log_file} not found or is None. Skipping storage.")
+    if log_file is None:
+        logging.warning("Temporary log file is None. Skipping storage.")
         return None
 
-    # Cílový adresář pro teplotu a cyklus
-    target_dir = output_dir / f"temp_{temp_c:.0f}C" / f"cycle_{cycle_num+1}"
-    try:
-        target_dir.mkdir(parents=True, exist_ok=True)
-    except OSError as e:
-        logging.error(f"Failed to create target directory {target_dir}: {e}")
-        return log_file
+    target_path = log_target_path(output_dir, temp_c, cycle_num, test_phase, target_name)
+    if target_path == log_file:
+        logging.info(f"Log file already at its final location: {target_path}")
+        return target_path
 
-    # Finální název souboru: TempC_cycleN_Mode_Phase.csv
-    # test_phase zde bude např. "linear_discharge", "switching_main", "random_main"
-    target_filename = f"{temp_c:.0f}C_cycle{cycle_num+1}_{test_phase}.csv"
-    target_path = target_dir / target_filename
+    # Cílový adresář pro teplotu a cyklus (vytvoří se jednou - módy téhož cyklu sdílí adresář)
+    target_dir = target_path.parent
+    if target_dir not in _created_dirs:
+        try:
+            target_dir.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            logging.error(f"Failed to create target directory {target_dir}: {e}")
+            return log_file
+        _created_dirs.add(target_dir)
 
     try:
-        log_file.rename(target_path)
+        try:
+            os.replace(log_file, target_path) # Atomické přejmenování (stejný souborový systém), přepíše i existující cíl
+        except OSError as e:
+            if e.errno != errno.EXDEV: raise
+            # Výstupní složka je na jiném svazku - streamované kopírování po 1 MiB, pak smazání zdroje
+            with open(log_file, 'rb') as src, open(target_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, length=1 << 20)
+            os.remove(log_file)
         logging.info(f"Stored log file: {target_path}")
         return target_path
+    except FileNotFoundError: # Existence se neověřuje předem - chybějící zdroj (nebo smazaný cílový adresář) ohlásí až os.replace
+        _created_dirs.discard(target_dir) # Příště adresář znovu vytvořit
+        logging.warning(f"Temporary log file {log_file} or target directory {target_dir} not found. Skipping storage.")
+        return log_file if log_file.exists() else None
     except OSError as e:
         logging.error(f"Failed to move log file from {log_file} to {target_path}: {e}")
         return log_file if log_file.exists() else None
\ No newline at end of file